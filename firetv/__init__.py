@@ -6,32 +6,64 @@ Communicate with an Amazon Fire TV device via ADB over a network.
 ADB Debugging must be enabled.
 """
 
+import codecs
+from contextlib import contextmanager
+import hashlib
+import io
 import logging
+import os
 import re
 from socket import error as socket_error
+import struct
 import sys
 import threading
+import time
+import uuid
 
-# Install adb shell if we can, then try the others
-USE_ADB_SHELL = False
-try:
-    from adb_shell.adb_device import AdbDevice, AdbDeviceTcp
-    from adb_shell.auth.sign_pythonrsa import PythonRSASigner
-    from adb_shell.exceptions import InvalidChecksumError
-
-    USE_ADB_SHELL = True
-except:
-    pass
+from firetv.adbservers import choose_server, get_server, parse_servers
+from firetv.state import DeviceState
+from firetv.uitree import parse_ui_tree
 
-
-if not USE_ADB_SHELL:
-    from adb import adb_commands
-    from adb.sign_pythonrsa import PythonRSASigner
-    from adb.adb_protocol import InvalidChecksumError
-    from adb_messenger.client import Client as AdbClient
+# Pillow is only needed for downscaling screenshots
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# ADB transports; each one's modules are only imported once a device uses it
+TRANSPORT_ADB_SHELL = 'adb_shell'
+TRANSPORT_PYTHON_ADB = 'python-adb'
+TRANSPORT_PURE_PYTHON_ADB = 'pure-python-adb'
+TRANSPORTS = (TRANSPORT_ADB_SHELL, TRANSPORT_PYTHON_ADB, TRANSPORT_PURE_PYTHON_ADB)
+
+# The module that must be installed for each transport
+TRANSPORT_MODULES = {TRANSPORT_ADB_SHELL: 'adb_shell',
+                     TRANSPORT_PYTHON_ADB: 'adb',
+                     TRANSPORT_PURE_PYTHON_ADB: 'adb_messenger'}
+
+
+def transport_available(transport):
+    """Check whether a transport's module is installed, without importing it.
+
+    :param transport: One of ``TRANSPORTS``.
+    :returns: Installed or not.
+    """
+    name = TRANSPORT_MODULES[transport]
+    try:
+        from importlib.util import find_spec
+    except ImportError:
+        import imp
+        try:
+            imp.find_module(name)
+            return True
+        except ImportError:
+            return False
+    return find_spec(name) is not None
 
 
-Signer = PythonRSASigner.FromRSAKeyPath
+# By default, use adb shell if it is installed, then try the others
+USE_ADB_SHELL = transport_available(TRANSPORT_ADB_SHELL)
 
 if sys.version_info[0] > 2 and sys.version_info[1] > 1:
     LOCK_KWARGS = {'timeout': 3}
@@ -50,17 +82,118 @@ WAKE_LOCK_SIZE_CMD = "dumpsys power | grep Locks | grep 'size='"
 CURRENT_APP_CMD = "dumpsys window windows | grep mCurrentFocus"
 RUNNING_APPS_CMD = "ps | grep u0_a"
 
+# Matches `dumpsys activity activities` output for app & activity name gathering
+RESUMED_ACTIVITY_REGEX = re.compile(r"ActivityRecord\{(?P<id>\S+) (?P<user>\S+) (?P<package>[^\s/}]+)(?:\/(?P<activity>[^\s}]+))?(?: t\d+)?\}")
+
+# Candidate ADB shell commands for the `screen_on`, `awake`, and `current_app`
+# properties, which differ in speed and support between Fire OS versions.  Each
+# candidate is a tuple of a shell command that outputs a single line, a regex
+# that the line must match, and (for boolean properties) the substring that
+# indicates `True`.  The first candidate of each property is the default.
+COMMAND_CANDIDATES = {'screen_on': [("dumpsys power | grep 'Display Power'", re.compile(r"state="), "state=ON"),
+                                    ("dumpsys display | grep mScreenState", re.compile(r"mScreenState="), "mScreenState=ON")],
+                      'awake': [("dumpsys power | grep mWakefulness", re.compile(r"mWakefulness="), "Awake"),
+                                ("dumpsys window policy | grep mAwake", re.compile(r"mAwake="), "mAwake=true")],
+                      'current_app': [(CURRENT_APP_CMD, WINDOW_REGEX, None),
+                                      ("dumpsys window | grep mCurrentFocus", WINDOW_REGEX, None),
+                                      ("dumpsys activity activities | grep mResumedActivity", RESUMED_ACTIVITY_REGEX, None)]}
+
+# ADB `exec-out` commands for taking a screenshot as a PNG or as a raw framebuffer
+SCREENCAP_PNG_CMD = "screencap -p"
+SCREENCAP_RAW_CMD = "screencap"
+
+# ADB `exec-out` command for dumping the UI hierarchy as XML
+UI_DUMP_CMD = "uiautomator dump /dev/tty"
+
+# How long (in seconds) `FireTV.ui_tree` reuses a dump; key presses discard it sooner
+UI_TREE_TTL = 2.
+
+# ADB shell command for dumping the log; `-T` limits it to lines at or after a timestamp
+LOGCAT_CMD = "logcat -d -v time"
+
+# Valid logcat tags, priorities, and timestamps (in the `-v time` format)
+LOGCAT_TAG_REGEX = re.compile(r"^(?:\*|[\w.\-]+)$")
+LOGCAT_PRIORITIES = ('V', 'D', 'I', 'W', 'E', 'F', 'S')
+LOGCAT_TIME_REGEX = re.compile(r"^\d\d-\d\d \d\d:\d\d:\d\d\.\d{3}")
+
+# ADB shell commands for getting and setting the media volume
+GET_VOLUME_CMD = "media volume --stream 3 --get"
+SET_VOLUME_CMD = "media volume --stream 3 --set {0}"
+
+# Matches `media volume` output
+VOLUME_REGEX = re.compile(r"volume is (?P<volume>\d+) in range \[(?P<min>\d+)\.\.(?P<max>\d+)\]")
+
+# The maximum media volume, if it can't be determined
+DEFAULT_MAX_VOLUME = 15
+
+# ADB shell commands for muting or unmuting the media stream, and for reading whether it is muted
+SET_MUTED_CMD = "cmd audio adjust-volume 3 {0}"
+GET_MUTED_CMD = "dumpsys audio | grep -A 1 -- '- STREAM_MUSIC:'"
+
+# Matches the mute state in `GET_MUTED_CMD` output
+MUTED_REGEX = re.compile(r"Muted: (?P<muted>true|false)")
+
+# The number of bytes to read at a time from a binary ADB stream
+CHUNK_SIZE = 64 * 1024
+
+# The directory to which APKs are pushed before being installed
+APK_TMP_DIR = "/data/local/tmp"
+
+# The file mode used for pushed files
+PUSH_MODE = 0o644
+
 # echo '1' if the previous shell command was successful
 SUCCESS1 = r" && echo -e '1\c'"
 
 # echo '1' if the previous shell command was successful, echo '0' if it was not
 SUCCESS1_FAILURE0 = r" && echo -e '1\c' || echo -e '0\c'"
 
+# The version of the status helper script; bump it when `HELPER_SCRIPT` changes
+HELPER_VERSION = 1
+
+# Where the status helper script is pushed to
+HELPER_PATH = APK_TMP_DIR + "/firetv-helper.sh"
+
+# A shell script that prints the `get_properties` properties as `key=value`
+# lines, using the device's selected commands (see `FireTV.probe_commands`).
+# Its arguments are whether to list the running apps and whether to stop
+# once the screen is off or the device is asleep (both "1" or "0").
+HELPER_SCRIPT = """#!/system/bin/sh
+# firetv-helper {id}
+s=0; {screen_on} && s=1
+echo screen_on=$s
+[ $s = 0 ] && [ "$2" = 1 ] && exit 0
+a=0; {awake} && a=1
+echo awake=$a
+[ $a = 0 ] && [ "$2" = 1 ] && exit 0
+echo "wake_lock=$({wake_lock_size})"
+echo "current_app=$({current_app})"
+[ "$1" = 1 ] || exit 0
+{running_apps} | while read -r line; do echo "running_app=${{line##* }}"; done
+"""
+
+# ADB shell command that outputs '1' if the helper script with the given identifier is installed
+HELPER_CHECK_CMD = "grep -qF '# firetv-helper {0}' " + HELPER_PATH + SUCCESS1
+
+# ADB shell command for running the helper script
+HELPER_CMD = "sh " + HELPER_PATH + " {0} {1}"
+
+# The shell code that follows each command run by `FireTV.adb_shell_many`; it
+# frames the command's output with a marker line holding its index and exit code
+SHELL_MANY_FRAME = "; r=$?; echo; echo '{marker}:{index}:'$r"
+
+# Matches a marker line in the output of `FireTV.adb_shell_many`
+SHELL_MANY_MARKER_REGEX = r"\n{marker}:(?P<index>\d+):(?P<retcode>\d+)\n"
+
+# Matches the wake lock line of `dumpsys power`
+WAKE_LOCK_SIZE_REGEX = re.compile(r"size=(?P<size>\d+)")
+
 # ADB key event codes.
 HOME = 3
 CENTER = 23
 VOLUME_UP = 24
 VOLUME_DOWN = 25
+VOLUME_MUTE = 164
 POWER = 26
 SLEEP = 223
 PLAY_PAUSE = 85
@@ -149,47 +282,166 @@ APPS = {AMAZON_VIDEO: 'Amazon Video',
 INTENT_LAUNCH = "android.intent.category.LAUNCHER"
 INTENT_HOME = "android.intent.category.HOME"
 
+# ADB shell commands for resolving an app's launcher activity
+RESOLVE_ACTIVITY_CMD = "cmd package resolve-activity --brief -c " + INTENT_LAUNCH + " {0}"
+PM_DUMP_ACTIVITY_CMD = "pm dump {0} | grep -A 1 'android.intent.action.MAIN:'"
+
+# ADB shell command for starting an activity directly
+START_ACTIVITY_CMD = "am start -n {0}"
+
+
+def split_lines(chunks):
+    """Split a stream of text chunks, which are not aligned to lines, into lines.
+
+    :param chunks: An iterable of strings, e.g. from ``FireTV.adb_streaming_shell``.
+    :returns: A generator of lines, without line endings.
+    """
+    partial = ''
+    for chunk in chunks:
+        lines = (partial + chunk).split('\n')
+        partial = lines.pop()
+        for line in lines:
+            yield line.rstrip('\r')
+
+    if partial:
+        yield partial.rstrip('\r')
+
+
+# The deadline (in seconds since the epoch) of ADB commands on each thread; see `deadline`
+_deadlines = threading.local()
+
+
+class DeadlineExceededError(IOError):
+    """An ADB command could not be completed before the deadline."""
+
+
+@contextmanager
+def deadline(timeout):
+    """Bound the time that ADB commands sent from this thread may take.
+
+    While the context is active, waiting for a device's ADB lock and reading
+    the reply to a shell command are limited to the remaining time, and
+    `DeadlineExceededError` is raised when it runs out.  Nested deadlines
+    cannot extend an enclosing one.
+
+    :param timeout: The time limit, in seconds.
+    """
+    previous = getattr(_deadlines, 'deadline', None)
+    _deadlines.deadline = time.time() + timeout
+    if previous is not None:
+        _deadlines.deadline = min(previous, _deadlines.deadline)
+    try:
+        yield
+    finally:
+        _deadlines.deadline = previous
+
+
+def remaining_time():
+    """Get the time left until the current thread's deadline.
+
+    :returns: The remaining time in seconds, or ``None`` if there is no deadline.
+    """
+    current = getattr(_deadlines, 'deadline', None)
+    if current is None:
+        return None
+    return current - time.time()
+
 
 class FireTV:
     """Represents an Amazon Fire TV device."""
 
-    def __init__(self, host, adbkey='', adb_server_ip='', adb_server_port=5037):
+    def __init__(self, host, adbkey='', adb_server_ip='', adb_server_port=5037, transport=None):
         """Initialize FireTV object.
 
         :param host: Host in format <address>:port.
         :param adbkey: The path to the "adbkey" file
-        :param adb_server_ip: the IP address for the ADB server
-        :param adb_server_port: the port for the ADB server
+        :param adb_server_ip: the IP address for the ADB server, or a comma-separated list of
+                              ``<address>[:<port>]`` entries to balance the load between several
+                              ADB servers and fail over between them (see `firetv.adbservers`)
+        :param adb_server_port: the port for the ADB server(s)
+        :param transport: one of ``TRANSPORTS``; by default, adb_shell is used if it is
+                          installed, otherwise python-adb, or pure-python-adb if
+                          ``adb_server_ip`` is given
+        :raises ValueError: if the transport is unknown or not installed
         """
         self.host = host
         self.adbkey = adbkey
         self.adb_server_ip = adb_server_ip
         self.adb_server_port = adb_server_port
 
+        if transport is None:
+            if USE_ADB_SHELL:
+                transport = TRANSPORT_ADB_SHELL
+            elif not self.adb_server_ip:
+                transport = TRANSPORT_PYTHON_ADB
+            else:
+                transport = TRANSPORT_PURE_PYTHON_ADB
+        elif transport not in TRANSPORTS:
+            raise ValueError("Unknown transport: {0}".format(transport))
+        if not transport_available(transport):
+            raise ValueError("Transport {0} is not installed (the {1} module is missing)".format(transport, TRANSPORT_MODULES[transport]))
+        self.transport = transport
+
+        # pure-python-adb: the ADB servers that can be used, and the one that the device is assigned to
+        self._adb_servers = []
+        self._adb_server = None
+        if self.transport == TRANSPORT_PURE_PYTHON_ADB:
+            self._adb_servers = [get_server(ip, port) for ip, port in parse_servers(adb_server_ip, adb_server_port)]
+
         # keep track of whether the ADB connection is intact
         self._available = False
 
+        # whether the connection was closed because a deadline expired; see `self._connected()`
+        self._reconnect = False
+
         # use a lock to make sure that ADB commands don't overlap
         self._adb_lock = threading.Lock()
 
+        # the ADB shell commands used for the `screen_on`, `awake`, and `current_app`
+        # properties; see `self.probe_commands()`
+        self._commands = {prop: self._candidate_cmd(candidates[0]) for prop, candidates in COMMAND_CANDIDATES.items()}
+        self._current_app_regex = WINDOW_REGEX
+        self._command_strategies = {}
+
+        # the identifier of the installed status helper script, or `None`; see `self.install_helper()`
+        self._helper = None
+
+        # the maximum media volume, once it is known
+        self._max_volume = None
+
+        # package -> launcher activity ("package/activity"), or `None` if it couldn't be resolved
+        self._launch_activities = {}
+
+        # the most recent UI hierarchy dump and when it was started; see `self.ui_tree()`
+        self._ui_tree = None
+
         # the attributes used for sending ADB commands; filled in in `self.connect()`
         self._adb = None  # python-adb
         self._adb_client = None  # pure-python-adb
         self._adb_device = None  # pure-python-adb && adb_shell
 
         # the methods used for sending ADB commands
-        if USE_ADB_SHELL:
+        if self.transport == TRANSPORT_ADB_SHELL:
             # adb_shell
             self.adb_shell = self._adb_shell_adb_shell
-            self.adb_streaming_shell = self._adb_shell_adb_shell
-        elif not self.adb_server_ip:
+            self.adb_streaming_shell = self._adb_streaming_shell_adb_shell
+            self.adb_exec_out = self._adb_exec_out_adb_shell
+            self.adb_push = self._adb_push_adb_shell
+            self.adb_pull = self._adb_pull_adb_shell
+        elif self.transport == TRANSPORT_PYTHON_ADB:
             # python-adb
             self.adb_shell = self._adb_shell_python_adb
             self.adb_streaming_shell = self._adb_streaming_shell_python_adb
+            self.adb_exec_out = self._adb_exec_out_python_adb
+            self.adb_push = self._adb_push_python_adb
+            self.adb_pull = self._adb_pull_python_adb
         else:
             # pure-python-adb
             self.adb_shell = self._adb_shell_pure_python_adb
             self.adb_streaming_shell = self._adb_streaming_shell_pure_python_adb
+            self.adb_exec_out = self._adb_exec_out_pure_python_adb
+            self.adb_push = self._adb_push_pure_python_adb
+            self.adb_pull = self._adb_pull_pure_python_adb
 
         # establish the ADB connection
         self.connect()
@@ -199,66 +451,334 @@ class FireTV:
     #                               ADB methods                               #
     #                                                                         #
     # ======================================================================= #
+    def _acquire_lock(self):
+        """Acquire the ADB lock, waiting no longer than the current deadline (see `deadline`).
+
+        :returns: True if the lock was acquired, False otherwise
+        """
+        timeout = remaining_time()
+        if timeout is None or 'timeout' not in LOCK_KWARGS:
+            return self._adb_lock.acquire(**LOCK_KWARGS)
+
+        if timeout <= 0 or not self._adb_lock.acquire(timeout=timeout):
+            raise DeadlineExceededError("Timed out waiting for the ADB lock for host: {0}".format(self.host))
+        return True
+
+    def _call_before_deadline(self, func, *args, **kwargs):
+        """Call a transport function whose timeout is set from the current deadline.
+
+        If the deadline expires while the command is running, the connection is
+        closed, because the reply may still arrive and would be mistaken for the
+        reply to the next command; it is reestablished by the next `connect`.
+        """
+        try:
+            return func(*args, **kwargs)
+        except Exception:  # pylint: disable=broad-except
+            self._check_deadline_exceeded()
+            raise
+
+    def _iterate_before_deadline(self, chunks):
+        """Iterate over a transport stream whose timeout is set from the current deadline.
+
+        See `_call_before_deadline`.
+        """
+        try:
+            for chunk in chunks:
+                yield chunk
+        except Exception:  # pylint: disable=broad-except
+            self._check_deadline_exceeded()
+            raise
+
+    def _check_deadline_exceeded(self):
+        """After a transport error, close the connection and raise `DeadlineExceededError` if the deadline has passed.
+
+        The connection is reestablished by the next command or availability check (see `_reconnect_if_closed`).
+        """
+        timeout = remaining_time()
+        if timeout is not None and timeout <= 0:
+            logging.warning("Deadline exceeded for host: %s; closing the ADB connection", self.host)
+            self._close_transport()
+            self._reconnect = True
+            raise DeadlineExceededError("Deadline exceeded for host: {0}".format(self.host))
+
+    def _reconnect_if_closed(self):
+        """Reconnect if a deadline closed the connection (see `_check_deadline_exceeded`).
+
+        If the connection can't be reestablished, the next check tries again.
+        """
+        if self._reconnect:
+            self._reconnect = False
+            if not self.connect(always_log_errors=False):
+                self._reconnect = True
+
+    def _connected(self, cheap=False):
+        """Check whether commands can be sent, first reconnecting if a deadline closed the connection.
+
+        :param cheap: whether to trust the last known connection state rather than checking `available`
+        :returns: True if the device is connected, False otherwise
+        """
+        if cheap:
+            self._reconnect_if_closed()
+            return self._available
+        return self.available
+
     def _adb_shell_adb_shell(self, cmd):
-        if not self.available:
+        if not self._connected():
             return None
 
-        if self._adb_lock.acquire(**LOCK_KWARGS):
+        if self._acquire_lock():
             try:
-                return self._adb_device.shell(cmd)
+                timeout = remaining_time()
+                if timeout is None:
+                    return self._adb_device.shell(cmd)
+                return self._call_before_deadline(self._adb_device.shell, cmd, timeout_s=timeout, total_timeout_s=timeout)
             finally:
                 self._adb_lock.release()
 
     def _adb_shell_python_adb(self, cmd):
-        if not self.available:
+        if not self._connected():
             return None
 
-        if self._adb_lock.acquire(**LOCK_KWARGS):
+        if self._acquire_lock():
             try:
-                return self._adb.Shell(cmd)
+                timeout = remaining_time()
+                if timeout is None:
+                    return self._adb.Shell(cmd)
+                return self._call_before_deadline(self._adb.Shell, cmd, timeout_ms=int(timeout * 1000))
             finally:
                 self._adb_lock.release()
 
     def _adb_shell_pure_python_adb(self, cmd):
-        if not self._available:
+        if not self._connected(cheap=True):
             return None
 
-        if self._adb_lock.acquire(**LOCK_KWARGS):
+        if self._acquire_lock():
             try:
-                return self._adb_device.shell(cmd)
+                # `close()` may have run while waiting for the lock
+                if not self._available or self._adb_server is None:
+                    return None
+
+                timeout = remaining_time()
+                if timeout is None:
+                    return self._adb_server_call(lambda device: device.shell(cmd))
+                return self._adb_server_call(lambda device: self._call_before_deadline(device.shell, cmd, timeout=timeout))
             finally:
                 self._adb_lock.release()
 
     def _adb_streaming_shell_adb_shell(self, cmd):
-        if not self.available:
-            return []
+        return _decode_chunks(self._adb_service_adb_shell('shell:', cmd))
 
-        if self._adb_lock.acquire(**LOCK_KWARGS):
+    def _adb_streaming_shell_python_adb(self, cmd):
+        return _decode_chunks(self._adb_service_python_adb('shell:', cmd))
+
+    def _adb_streaming_shell_pure_python_adb(self, cmd):
+        return _decode_chunks(self._adb_service_pure_python_adb('shell:', cmd))
+
+    def _adb_exec_out_adb_shell(self, cmd):
+        return self._adb_service_adb_shell('exec:', cmd)
+
+    def _adb_exec_out_python_adb(self, cmd):
+        return self._adb_service_python_adb('exec:', cmd)
+
+    def _abandon_stream(self):
+        """Close the connection after a consumer stopped reading a stream; the caller must hold the ADB lock.
+
+        The rest of the stream may still arrive and would be mistaken for the
+        reply to the next command, so the connection is reestablished by the
+        next command instead (see `_reconnect_if_closed`).
+        """
+        logging.debug("Stream abandoned for host: %s; closing the ADB connection", self.host)
+        self._close_transport()
+        self._reconnect = True
+
+    def _adb_service_adb_shell(self, service, cmd):
+        """Stream the raw output of an ADB service (e.g., ``shell:`` or ``exec:``)."""
+        if not self._connected():
+            return
+
+        if self._acquire_lock():
             try:
-                return self._adb_device.shell(cmd)
+                timeout = remaining_time()
+                service = service.rstrip(':').encode('utf8')
+                if timeout is None:
+                    chunks = self._adb_device._streaming_service(service, cmd.encode('utf8'), decode=False)  # pylint: disable=protected-access
+                else:
+                    chunks = self._adb_device._streaming_service(service, cmd.encode('utf8'), decode=False, timeout_s=timeout, total_timeout_s=timeout)  # pylint: disable=protected-access
+                for chunk in self._iterate_before_deadline(chunks):
+                    yield chunk
+            except GeneratorExit:
+                self._abandon_stream()
+                raise
             finally:
                 self._adb_lock.release()
 
-    def _adb_streaming_shell_python_adb(self, cmd):
-        if not self.available:
-            return []
+    def _adb_service_python_adb(self, service, cmd):
+        """Stream the raw output of an ADB service (e.g., ``shell:`` or ``exec:``)."""
+        if not self._connected():
+            return
 
-        if self._adb_lock.acquire(**LOCK_KWARGS):
+        if self._acquire_lock():
             try:
-                return self._adb.StreamingShell(cmd)
+                timeout = remaining_time()
+                timeout_ms = None if timeout is None else int(timeout * 1000)
+                connection = self._call_before_deadline(self._adb.protocol_handler.Open, self._adb._handle, destination=(service + cmd).encode('utf8'), timeout_ms=timeout_ms)  # pylint: disable=protected-access
+                if not connection:
+                    return
+                for chunk in self._iterate_before_deadline(connection.ReadUntilClose()):
+                    yield chunk
+            except GeneratorExit:
+                self._abandon_stream()
+                raise
             finally:
                 self._adb_lock.release()
 
-    def _adb_streaming_shell_pure_python_adb(self, cmd):
-        if not self._available:
-            return None
+    def _adb_exec_out_pure_python_adb(self, cmd):
+        return self._adb_service_pure_python_adb('exec:', cmd)
 
-        # this is not yet implemented
-        if self._adb_lock.acquire(**LOCK_KWARGS):
+    def _adb_service_pure_python_adb(self, service, cmd):
+        """Stream the raw output of an ADB service (e.g., ``shell:`` or ``exec:``) via the ADB server."""
+        if not self._connected(cheap=True):
+            return
+
+        if self._acquire_lock():
+            try:
+                # `close()` may have run while waiting for the lock
+                if not self._available or self._adb_server is None:
+                    return
+
+                timeout = remaining_time()
+                connection = self._adb_server_call(lambda device: _open_service(device, service + cmd, timeout))
+                try:
+                    with self._adb_server.busy():
+                        chunk = connection.read(CHUNK_SIZE)
+                        while chunk:
+                            yield chunk
+                            chunk = connection.read(CHUNK_SIZE)
+                except Exception:  # pylint: disable=broad-except
+                    self._check_deadline_exceeded()
+                    raise
+                finally:
+                    connection.close()
+            finally:
+                self._adb_lock.release()
+
+    def _adb_push_adb_shell(self, stream, device_path, progress_callback=None):
+        if not self._connected():
+            return False
+
+        if self._acquire_lock():
+            try:
+                timeout = remaining_time()
+                if timeout is None:
+                    self._adb_device.push(stream, device_path, st_mode=PUSH_MODE, progress_callback=progress_callback)
+                else:
+                    self._call_before_deadline(self._adb_device.push, stream, device_path, st_mode=PUSH_MODE, progress_callback=progress_callback,
+                                               timeout_s=timeout, total_timeout_s=timeout)
+                return True
+            finally:
+                self._adb_lock.release()
+        return False
+
+    def _adb_push_python_adb(self, stream, device_path, progress_callback=None):
+        if not self._connected():
+            return False
+
+        if self._acquire_lock():
+            try:
+                timeout = remaining_time()
+                if timeout is None:
+                    self._adb.Push(stream, device_path, st_mode=PUSH_MODE, progress_callback=progress_callback)
+                else:
+                    self._call_before_deadline(self._adb.Push, stream, device_path, st_mode=PUSH_MODE, progress_callback=progress_callback,
+                                               timeout_ms=int(timeout * 1000))
+                return True
+            finally:
+                self._adb_lock.release()
+        return False
+
+    def _adb_push_pure_python_adb(self, stream, device_path, progress_callback=None):
+        if not self._connected(cheap=True):
+            return False
+
+        if self._acquire_lock():
+            try:
+                # `close()` may have run while waiting for the lock
+                if not self._available or self._adb_server is None:
+                    return False
+
+                timeout = remaining_time()
+                connection = self._adb_server_call(lambda device: _open_service(device, 'sync:', timeout))
+                try:
+                    with self._adb_server.busy():
+                        _sync_push(connection, stream, device_path, progress_callback)
+                    return True
+                except Exception:  # pylint: disable=broad-except
+                    self._check_deadline_exceeded()
+                    raise
+                finally:
+                    connection.close()
+            finally:
+                self._adb_lock.release()
+        return False
+
+    def _adb_pull_adb_shell(self, device_path, stream, progress_callback=None):
+        if not self._connected():
+            return False
+
+        if self._acquire_lock():
+            try:
+                timeout = remaining_time()
+                if timeout is None:
+                    self._adb_device.pull(device_path, stream, progress_callback=progress_callback)
+                else:
+                    self._call_before_deadline(self._adb_device.pull, device_path, stream, progress_callback=progress_callback,
+                                               timeout_s=timeout, total_timeout_s=timeout)
+                return True
+            finally:
+                self._adb_lock.release()
+        return False
+
+    def _adb_pull_python_adb(self, device_path, stream, progress_callback=None):
+        if not self._connected():
+            return False
+
+        if self._acquire_lock():
+            try:
+                timeout = remaining_time()
+                if timeout is None:
+                    self._adb.Pull(device_path, stream, progress_callback=progress_callback)
+                else:
+                    self._call_before_deadline(self._adb.Pull, device_path, stream, progress_callback=progress_callback,
+                                               timeout_ms=int(timeout * 1000))
+                return True
+            finally:
+                self._adb_lock.release()
+        return False
+
+    def _adb_pull_pure_python_adb(self, device_path, stream, progress_callback=None):
+        if not self._connected(cheap=True):
+            return False
+
+        if self._acquire_lock():
             try:
-                return []
+                # `close()` may have run while waiting for the lock
+                if not self._available or self._adb_server is None:
+                    return False
+
+                timeout = remaining_time()
+                connection = self._adb_server_call(lambda device: _open_service(device, 'sync:', timeout))
+                try:
+                    with self._adb_server.busy():
+                        _sync_pull(connection, device_path, stream, progress_callback)
+                    return True
+                except Exception:  # pylint: disable=broad-except
+                    self._check_deadline_exceeded()
+                    raise
+                finally:
+                    connection.close()
             finally:
                 self._adb_lock.release()
+        return False
 
     def _dump(self, service, grep=None):
         """Perform a service dump.
@@ -291,6 +811,8 @@ class FireTV:
 
         :param key: Key constant.
         """
+        # the screen is about to change
+        self._ui_tree = None
         self.adb_shell('input keyevent {0}'.format(key))
 
     def _ps(self, search=''):
@@ -304,30 +826,96 @@ class FireTV:
         result = []
         ps = self.adb_streaming_shell('ps')
         try:
-            for bad_line in ps:
-                # The splitting of the StreamingShell doesn't always work
-                # this is to ensure that we get only one line
-                for line in bad_line.splitlines():
-                    if search in line:
-                        result.append(line.strip().rsplit(' ', 1)[-1])
+            for line in split_lines(ps):
+                if search in line:
+                    result.append(line.strip().rsplit(' ', 1)[-1])
             return result
-        except InvalidChecksumError as e:
+        except self._invalid_checksum_error() as e:
             print(e)
             self.connect()
             raise IOError
 
+    def _invalid_checksum_error(self):
+        """Get the transport's exception for corrupted ADB messages (or an empty tuple, which catches nothing)."""
+        if self.transport == TRANSPORT_ADB_SHELL:
+            from adb_shell.exceptions import InvalidChecksumError
+            return InvalidChecksumError
+        if self.transport == TRANSPORT_PYTHON_ADB:
+            from adb.adb_protocol import InvalidChecksumError
+            return InvalidChecksumError
+        return ()
+
+    def _signer(self):
+        """Load the RSA signer for ``self.adbkey`` using the transport's signer class."""
+        if not self.adbkey:
+            return None
+        if self.transport == TRANSPORT_ADB_SHELL:
+            from adb_shell.auth.sign_pythonrsa import PythonRSASigner
+        else:
+            from adb.sign_pythonrsa import PythonRSASigner
+        return PythonRSASigner.FromRSAKeyPath(self.adbkey)
+
     def _send_intent(self, pkg, intent, count=1):
 
-        cmd = 'monkey -p {} -c {} {}; echo $?'.format(pkg, intent, count)
+        cmd = 'monkey -p {} -c {} {}'.format(pkg, intent, count)
         logging.debug("Sending an intent %s to %s (count: %s)", intent, pkg, count)
 
+        return self._shell_retcode(cmd)
+
+    def _start_activity(self, component):
+        """Start an activity directly, bypassing ``monkey``.
+
+        :param component: The activity, in the format "package/activity".
+        :returns: A dictionary with the ``retcode`` and ``output`` of the command.
+        """
+        logging.debug("Starting activity %s", component)
+        return self._shell_retcode(START_ACTIVITY_CMD.format(component))
+
+    def adb_shell_many(self, cmds, stop_on_failure=False):
+        """Run several shell commands in one round trip.
+
+        Each command runs in its own subshell, and its output is framed by a
+        marker line with a random token and the command's exit code, so a
+        command that fails or outputs nothing doesn't affect the results of
+        the others.
+
+        :param cmds: A list of shell commands.
+        :param stop_on_failure: whether to skip the remaining commands after one fails
+        :returns: A list with a dictionary with the ``retcode`` (an int) and ``output`` of each command,
+                  or ``None`` for commands that did not run; ``None`` if the ADB command was unsuccessful
+        """
+        marker = 'FIRETV-' + uuid.uuid4().hex
+        script = []
+        for index, cmd in enumerate(cmds):
+            script.append('(' + cmd + ')' + SHELL_MANY_FRAME.format(marker=marker, index=index))
+            if stop_on_failure:
+                script.append('[ $r = 0 ] || exit 0')
+
+        output = self.adb_shell('; '.join(script))
+        if output is None:
+            return None
+
+        output = output.replace('\r\n', '\n')
+        results = [None] * len(cmds)
+        start = 0
+        for matches in re.finditer(SHELL_MANY_MARKER_REGEX.format(marker=marker), output):
+            results[int(matches.group('index'))] = {'retcode': int(matches.group('retcode')), 'output': output[start:matches.start()]}
+            start = matches.end()
+        return results
+
+    def _shell_retcode(self, cmd):
+        """Run a shell command and get its return code and output.
+
+        :param cmd: The shell command.
+        :returns: A dictionary with the ``retcode`` and ``output`` of the command.
+        """
         # adb shell outputs in weird format, so we cut it into lines,
         # separate the retcode and return info to the user
-        res = self.adb_shell(cmd)
+        res = self.adb_shell(cmd + '; echo $?')
         if res is None:
             return {}
 
-        res = res.strip().split("\r\n")
+        res = res.strip().splitlines()
         retcode = res[-1]
         output = "\n".join(res[:-1])
 
@@ -338,43 +926,77 @@ class FireTV:
 
         Will attempt to establish ADB connection to the given host.
         Failure sets state to UNKNOWN and disables sending actions.
+        Successful connections also select the fastest working
+        commands for the device until one has been found for every
+        property; see `probe_commands`, and install the status
+        helper script; see `install_helper`.
+
+        Within a `deadline`, the connection attempt is bounded by the
+        remaining time, and probing and installing the helper are left
+        to a later connect without one.
 
         :returns: True if successful, False otherwise
         """
-        self._adb_lock.acquire(**LOCK_KWARGS)
-        signer = None
-        if self.adbkey:
-            signer = Signer(self.adbkey)
+        self._connect(always_log_errors)
+        if remaining_time() is not None:
+            return self._available
+
+        if self._available and len(self._command_strategies) < len(COMMAND_CANDIDATES):
+            self.probe_commands()
+
+        if self._available and not self._helper:
+            self.install_helper()
+
+        return self._available
+
+    def _connect(self, always_log_errors=True):
+        """Establish the ADB connection for `connect`."""
+        timeout = remaining_time()
+        if timeout is None or 'timeout' not in LOCK_KWARGS:
+            acquired = self._adb_lock.acquire(**LOCK_KWARGS)
+        else:
+            acquired = timeout > 0 and self._adb_lock.acquire(timeout=timeout)
+        if not acquired:
+            return self._available
+
         try:
-            if USE_ADB_SHELL:
+            signer = None
+            if self.adbkey and self.transport != TRANSPORT_PURE_PYTHON_ADB:
+                signer = self._signer()
+
+            # the time left for connecting, or `None` to use the transport's defaults
+            timeout = remaining_time()
+
+            if self.transport == TRANSPORT_ADB_SHELL:
                 # adb_shell
+                from adb_shell.adb_device import AdbDeviceTcp
                 host, _, port = self.host.partition(':')
                 self._adb_device = AdbDeviceTcp(host=host, port=port)
 
                 # Connect to the device
                 connected = False
                 from adb_shell.exceptions import DeviceAuthError
+                kwargs = {} if timeout is None else {'timeout_s': timeout, 'auth_timeout_s': timeout, 'total_timeout_s': timeout}
+                if signer:
+                    kwargs['rsa_keys'] = [signer]
                 try:
-                    if signer:
-                        connected = self._adb_device.connect(rsa_keys=[signer])
-                    else:
-                        connected = self._adb_device.connect()
+                    connected = self._call_before_deadline(self._adb_device.connect, **kwargs)
                 except DeviceAuthError as err:
                     print("DeviceAuthError:", err)
 
                 self._available = connected
 
-            elif not self.adb_server_ip:
+            elif self.transport == TRANSPORT_PYTHON_ADB:
                 # python-adb
+                from adb import adb_commands
                 from adb.usb_exceptions import DeviceAuthError
+                timeout_ms = 9000 if timeout is None else max(1, min(9000, int(timeout * 1000)))
                 try:
                     if self.adbkey:
-                        signer = Signer(self.adbkey)
-
                         # Connect to the device
-                        self._adb = adb_commands.AdbCommands().ConnectDevice(serial=self.host, rsa_keys=[signer], default_timeout_ms=9000)
+                        self._adb = adb_commands.AdbCommands().ConnectDevice(serial=self.host, rsa_keys=[signer], default_timeout_ms=timeout_ms)
                     else:
-                        self._adb = adb_commands.AdbCommands().ConnectDevice(serial=self.host, default_timeout_ms=9000)
+                        self._adb = adb_commands.AdbCommands().ConnectDevice(serial=self.host, default_timeout_ms=timeout_ms)
 
                     # ADB connection successfully established
                     self._available = True
@@ -397,20 +1019,209 @@ class FireTV:
 
             else:
                 # pure-python-adb
-                try:
-                    self._adb_client = AdbClient(host=self.adb_server_ip, port=self.adb_server_port)
-                    self._adb_device = self._adb_client.device(self.host)
-                    self._available = bool(self._adb_device)
-
-                except:
-                    self._available = False
-
-                finally:
-                    return self._available
+                return self._connect_adb_server()
 
         finally:
             self._adb_lock.release()
 
+    def close(self):
+        """Close the ADB connection."""
+        if self._adb_lock.acquire(**LOCK_KWARGS):
+            try:
+                self._close_transport()
+            finally:
+                self._adb_lock.release()
+
+    def _close_transport(self):
+        """Close the ADB connection; the caller must hold the ADB lock."""
+        if self.transport == TRANSPORT_ADB_SHELL:
+            # adb_shell
+            if self._adb_device:
+                self._adb_device.close()
+
+        elif self.transport == TRANSPORT_PYTHON_ADB:
+            # python-adb
+            if self._adb:
+                self._adb.Close()
+            self._adb = None
+
+        # pure-python-adb: the connection belongs to the ADB server
+        else:
+            self._assign_adb_server(None)
+            self._adb_client = None
+            self._adb_device = None
+
+        self._available = False
+
+    def _connect_adb_server(self, exclude=()):
+        """Connect to the device through the least-loaded healthy ADB server; the caller must hold the ADB lock.
+
+        If the server does not know the device, it is asked to connect to it.
+
+        :param exclude: ADB servers that must not be used.
+        :returns: True if successful, False otherwise
+        """
+        tried = list(exclude)
+        server = choose_server(self._adb_servers, tried)
+        while server is not None:
+            tried.append(server)
+            try:
+                client = server.client()
+                device = client.device(self.host)
+                if device is None and hasattr(client, 'remote_connect'):
+                    address, _, port = self.host.partition(':')
+                    client.remote_connect(address, int(port or 5555))
+                    device = client.device(self.host)
+            except Exception as err:  # pylint: disable=broad-except
+                server.mark_failed(err)
+            else:
+                server.mark_ok()
+                if device:
+                    self._assign_adb_server(server)
+                    self._adb_client = client
+                    self._adb_device = device
+                    self._available = True
+                    return True
+
+            server = choose_server(self._adb_servers, tried)
+
+        self._assign_adb_server(None)
+        self._available = False
+        return False
+
+    def _assign_adb_server(self, server):
+        """Move the device to another ADB server (or to none), keeping the servers' device counts up to date."""
+        if server is self._adb_server:
+            return
+        if self._adb_server:
+            self._adb_server.assign(-1)
+        if server:
+            server.assign(1)
+        self._adb_server = server
+
+    def _adb_server_call(self, func):
+        """Call ``func(device)`` through the device's ADB server, failing over to another server if it fails.
+
+        The caller must hold the ADB lock, so commands that are waiting for it
+        are sent through the new server rather than lost.
+        """
+        server = self._adb_server
+        try:
+            with server.busy():
+                return func(self._adb_device)
+        except (RuntimeError, socket_error) as err:
+            timeout = remaining_time()
+            if isinstance(err, DeadlineExceededError) or (timeout is not None and timeout <= 0):
+                raise
+
+            server.mark_failed(err)
+            if not self._connect_adb_server(exclude=[server]):
+                raise
+
+            logging.warning("Moved host %s from ADB server %s:%d to %s:%d", self.host, server.host, server.port,
+                            self._adb_server.host, self._adb_server.port)
+            with self._adb_server.busy():
+                return func(self._adb_device)
+
+    @staticmethod
+    def _candidate_cmd(candidate):
+        """Get the ADB shell command for a candidate in ``COMMAND_CANDIDATES``."""
+        cmd, _, test = candidate
+        if test is None:
+            return cmd
+        return "{0} | grep -q '{1}'".format(cmd, test)
+
+    def probe_commands(self):
+        """Select the fastest working command for each property in ``COMMAND_CANDIDATES``.
+
+        Each candidate command is run once and timed; a candidate works if it
+        outputs exactly one line that matches its regex.  If no candidate works
+        for a property (e.g. while the device is in standby), the default
+        command is kept and the property is probed again on the next call;
+        properties that were already selected are not probed again.
+
+        :returns: The selected strategies (see `command_strategies`).
+        """
+        strategies = dict(self._command_strategies)
+        for prop, candidates in COMMAND_CANDIDATES.items():
+            if prop in strategies:
+                continue
+
+            best = None
+            for candidate in candidates:
+                cmd, regex, _ = candidate
+                start = time.time()
+                output = self.adb_shell(cmd)
+                elapsed = time.time() - start
+
+                # ADB command was unsuccessful; try again on the next connect
+                if output is None:
+                    return self._command_strategies
+
+                lines = output.strip().splitlines()
+                if len(lines) == 1 and regex.search(lines[0]) and (best is None or elapsed < best[1]):
+                    best = (candidate, elapsed)
+
+            if best:
+                candidate, elapsed = best
+                strategies[prop] = {'cmd': self._candidate_cmd(candidate), 'time': elapsed}
+            else:
+                logging.info("No working command for property %s on host: %s; using the default until the next connect", prop, self.host)
+
+        if strategies == self._command_strategies:
+            return strategies
+
+        for prop, strategy in strategies.items():
+            self._commands[prop] = strategy['cmd']
+        if 'current_app' in strategies:
+            self._current_app_regex = next(regex for cmd, regex, _ in COMMAND_CANDIDATES['current_app'] if cmd == strategies['current_app']['cmd'])
+
+        self._command_strategies = strategies
+
+        # the status helper script embeds the selected commands
+        if self._helper:
+            self.install_helper()
+
+        return strategies
+
+    def _helper_script(self):
+        """Get the identifier and contents of the status helper script for the selected commands."""
+        commands = {'screen_on': self._commands['screen_on'],
+                    'awake': self._commands['awake'],
+                    'wake_lock_size': WAKE_LOCK_SIZE_CMD,
+                    'current_app': self._commands['current_app'],
+                    'running_apps': RUNNING_APPS_CMD}
+        digest = hashlib.md5(repr(sorted(commands.items())).encode('utf8')).hexdigest()[:8]
+        helper_id = '{0}-{1}'.format(HELPER_VERSION, digest)
+        return helper_id, HELPER_SCRIPT.format(id=helper_id, **commands)
+
+    def install_helper(self):
+        """Push the status helper script to ``HELPER_PATH`` if it is missing or outdated.
+
+        Once it is installed, `get_properties` runs the script by name instead of
+        sending the full inline command, and falls back to the inline command if
+        the script can't be used.
+
+        :returns: True if the helper is installed, False otherwise
+        """
+        helper_id, script = self._helper_script()
+        if self._helper == helper_id:
+            return True
+
+        self._helper = None
+        installed = self.adb_shell(HELPER_CHECK_CMD.format(helper_id))
+        if installed is None:
+            return False
+
+        if installed.strip() != '1':
+            logging.debug("Installing status helper %s on host: %s", helper_id, self.host)
+            if not self.push(io.BytesIO(script.encode('utf8')), HELPER_PATH):
+                logging.warning("Couldn't install the status helper on host: %s", self.host)
+                return False
+
+        self._helper = helper_id
+        return True
+
     # ======================================================================= #
     #                                                                         #
     #                          Home Assistant Update                          #
@@ -480,6 +1291,17 @@ class FireTV:
 
         return state, current_app, running_apps
 
+    def update_state(self, get_running_apps=True):
+        """Get the state of the device, the current app, and the running apps as a `DeviceState`.
+
+        Equal snapshots are the same object, so ``state is previous`` (or
+        ``state.diff(previous)``) cheaply tells whether anything changed.
+
+        :param get_running_apps: whether or not to get the ``running_apps`` property
+        :returns: The `DeviceState`.
+        """
+        return DeviceState(*self.update(get_running_apps=get_running_apps))
+
     # ======================================================================= #
     #                                                                         #
     #                              App methods                                #
@@ -494,13 +1316,225 @@ class FireTV:
         return STATE_OFF
 
     def launch_app(self, app):
-        """Launch an app."""
+        """Launch an app.
+
+        The app's launcher activity is resolved once and then started directly,
+        which is much faster than ``monkey``.  If that fails (e.g., because the
+        app was updated), the cached activity is discarded and ``monkey`` is used.
+        """
+        component = self.launch_activity(app)
+        if component:
+            res = self._start_activity(component)
+            if res and res['retcode'] == '0' and 'Error' not in res['output']:
+                return res
+
+            self._launch_activities.pop(app, None)
+
         return self._send_intent(app, INTENT_LAUNCH)
 
+    def launch_activity(self, app):
+        """Get the launcher activity of an app, resolving and caching it if necessary.
+
+        :param app: The package name.
+        :returns: The activity, in the format "package/activity", or ``None``.
+        """
+        if app in self._launch_activities:
+            return self._launch_activities[app]
+
+        component_regex = re.compile(re.escape(app) + r"/[\w.$]+")
+        for cmd in (RESOLVE_ACTIVITY_CMD, PM_DUMP_ACTIVITY_CMD):
+            output = self.adb_shell(cmd.format(app))
+
+            # ADB command was unsuccessful; don't cache anything
+            if output is None:
+                return None
+
+            matches = component_regex.search(output)
+            if matches:
+                self._launch_activities[app] = matches.group(0)
+                return self._launch_activities[app]
+
+        self._launch_activities[app] = None
+        return None
+
+    def clear_launch_activities(self, app=None):
+        """Forget cached launcher activities.
+
+        :param app: The package name, or ``None`` to forget all of them.
+        """
+        if app is None:
+            self._launch_activities.clear()
+        else:
+            self._launch_activities.pop(app, None)
+
     def stop_app(self, app):
         """Stop an app."""
         return self.adb_shell("am force-stop {0}".format(app))
 
+    # ======================================================================= #
+    #                                                                         #
+    #                              logcat methods                             #
+    #                                                                         #
+    # ======================================================================= #
+    def logcat(self, filters=None, priority=None, since=None):
+        """Get lines from the device log.
+
+        Filtering happens on the device, so only matching lines are transferred.
+
+        :param filters: a dictionary mapping tags to minimum priorities (e.g., ``{'ActivityManager': 'I'}``);
+                        if given, lines with other tags are excluded unless ``priority`` is given
+        :param priority: the minimum priority of all other lines (one of ``LOGCAT_PRIORITIES``)
+        :param since: only get lines at or after this timestamp (in the format "MM-DD hh:mm:ss.mmm")
+        :returns: A generator of log lines in the ``-v time`` format.
+        """
+        specs = []
+        for tag, tag_priority in (filters or {}).items():
+            if not LOGCAT_TAG_REGEX.match(tag) or tag_priority not in LOGCAT_PRIORITIES:
+                raise ValueError("Invalid logcat filter: {0}:{1}".format(tag, tag_priority))
+            specs.append('{0}:{1}'.format(tag, tag_priority))
+
+        if priority:
+            if priority not in LOGCAT_PRIORITIES:
+                raise ValueError("Invalid logcat priority: {0}".format(priority))
+            specs.append('*:{0}'.format(priority))
+        elif specs:
+            specs.append('*:S')
+
+        cmd = LOGCAT_CMD
+        if since:
+            if not LOGCAT_TIME_REGEX.match(since):
+                raise ValueError("Invalid logcat timestamp: {0}".format(since))
+            cmd += " -T '{0}'".format(since)
+        if specs:
+            cmd += " " + " ".join("'{0}'".format(spec) for spec in specs)
+
+        for line in split_lines(self.adb_streaming_shell(cmd)):
+            if line:
+                yield line
+
+    # ======================================================================= #
+    #                                                                         #
+    #                            screenshot methods                           #
+    #                                                                         #
+    # ======================================================================= #
+    def screencap(self, png=True, width=None):
+        """Take a screenshot.
+
+        The image is transferred via ``exec-out``, so it is not subject to the
+        newline translation that a shell session applies to binary output.
+
+        :param png: whether to get a PNG image (``True``) or the raw framebuffer (``False``)
+        :param width: if given, downscale the PNG image to this width (requires Pillow)
+        :returns: The image as bytes, or ``None`` if the screenshot could not be taken.
+        """
+        data = b''.join(self.screencap_stream(png))
+        if not data:
+            return None
+
+        if not png or not width:
+            return data
+        return downscale_png(data, width)
+
+    def screencap_stream(self, png=True):
+        """Take a screenshot and stream it as it is transferred.
+
+        :param png: whether to get a PNG image (``True``) or the raw framebuffer (``False``)
+        :returns: An iterator of the image's bytes; nothing is yielded if the screenshot could not be taken.
+        """
+        return self.adb_exec_out(SCREENCAP_PNG_CMD if png else SCREENCAP_RAW_CMD)
+
+    # ======================================================================= #
+    #                                                                         #
+    #                           UI hierarchy methods                          #
+    #                                                                         #
+    # ======================================================================= #
+    def ui_tree(self, max_age=UI_TREE_TTL):
+        """Get the UI hierarchy currently on screen.
+
+        The hierarchy is dumped with ``uiautomator`` via ``exec-out`` and parsed as
+        it is read.  Since a dump takes seconds, it is reused for up to ``max_age``
+        seconds, or until a key is sent with this object.
+
+        :param max_age: the maximum age (in seconds) of a reused dump; 0 always dumps the hierarchy
+        :returns: A `firetv.uitree.UiTree`, or ``None`` if the hierarchy could not be dumped.
+        """
+        cached = self._ui_tree
+        if cached and time.time() - cached[0] < max_age:
+            return cached[1]
+
+        start = time.time()
+        tree = parse_ui_tree(self.adb_exec_out(UI_DUMP_CMD))
+        if tree is None:
+            logging.warning("Couldn't dump the UI hierarchy of host: %s", self.host)
+            return None
+
+        self._ui_tree = (start, tree)
+        return tree
+
+    # ======================================================================= #
+    #                                                                         #
+    #                          file transfer methods                          #
+    #                                                                         #
+    # ======================================================================= #
+    def push(self, local, device_path, progress_callback=None):
+        """Push a file to the device.
+
+        The file is streamed in chunks, so memory use does not depend on its size.
+
+        :param local: the path to a local file, or a binary file-like object
+        :param device_path: the destination path on the device
+        :param progress_callback: called as ``progress_callback(device_path, bytes_written, total_bytes)``
+        :returns: True if successful, False otherwise
+        """
+        if not hasattr(local, 'read'):
+            with open(local, 'rb') as stream:
+                return self.adb_push(stream, device_path, progress_callback)
+        return self.adb_push(local, device_path, progress_callback)
+
+    def pull(self, device_path, local, progress_callback=None):
+        """Pull a file from the device.
+
+        The file is streamed in chunks, so memory use does not depend on its size.
+
+        :param device_path: the path of the file on the device
+        :param local: the path to a local file, or a binary file-like object
+        :param progress_callback: called as ``progress_callback(device_path, bytes_read, total_bytes)``
+        :returns: True if successful, False otherwise
+        """
+        if not hasattr(local, 'write'):
+            with open(local, 'wb') as stream:
+                return self.adb_pull(device_path, stream, progress_callback)
+        return self.adb_pull(device_path, local, progress_callback)
+
+    def install_apk(self, apk, replace=True, progress_callback=None):
+        """Install an APK on the device.
+
+        The APK is pushed to ``APK_TMP_DIR`` under a generated name (the local
+        name never reaches the device shell), installed with ``pm install``,
+        and then deleted from the device.
+
+        :param apk: the path to a local APK, or a binary file-like object
+        :param replace: whether to replace an existing installation of the app
+        :param progress_callback: called as ``progress_callback(device_path, bytes_written, total_bytes)``
+        :returns: The output of ``pm install``, or ``None`` if the APK could not be pushed.
+        """
+        if hasattr(apk, 'read'):
+            name = getattr(apk, 'name', '') or 'firetv.apk'
+        else:
+            name = apk
+        device_path = '{0}/firetv-{1}.apk'.format(APK_TMP_DIR, uuid.uuid4().hex)
+
+        if not self.push(apk, device_path, progress_callback):
+            return None
+
+        output = self.adb_shell('pm install {0}"{1}"; rm -f "{1}"'.format('-r ' if replace else '', device_path))
+        if output is None or 'Success' not in output:
+            logging.warning("Couldn't install %r on host: %s, reply was %s", name, self.host, output)
+        else:
+            # the installed app's launcher activity may have changed
+            self.clear_launch_activities()
+        return output
+
     # ======================================================================= #
     #                                                                         #
     #                               properties                                #
@@ -530,22 +1564,31 @@ class FireTV:
         # Otherwise, device is paused.
         return STATE_PAUSED
 
+    @property
+    def command_strategies(self):
+        """The commands selected by `probe_commands` and how long (in seconds) they took."""
+        return {prop: dict(strategy) for prop, strategy in self._command_strategies.items()}
+
     @property
     def available(self):
-        """Check whether the ADB connection is intact."""
+        """Check whether the ADB connection is intact, first reconnecting if a deadline closed it."""
+        self._reconnect_if_closed()
 
-        if USE_ADB_SHELL:
+        if self.transport == TRANSPORT_ADB_SHELL:
             # adb_shell
             if not self._adb_device:
                 return False
 
             return self._adb_device.available
 
-        if not self.adb_server_ip:
+        if self.transport == TRANSPORT_PYTHON_ADB:
             # python-adb
             return bool(self._adb)
 
         # pure-python-adb
+        if not self._adb_client:
+            return False
+
         try:
             # make sure the server is available
             adb_devices = self._adb_client.devices()
@@ -570,10 +1613,12 @@ class FireTV:
                     self._available = False
                 return False
 
-        except RuntimeError:
+        except (RuntimeError, socket_error) as err:
             if self._available:
                 logging.error('ADB server is unavailable.')
                 self._available = False
+            if self._adb_server:
+                self._adb_server.mark_failed(err)
             return False
 
     @property
@@ -587,12 +1632,12 @@ class FireTV:
     @property
     def current_app(self):
         """Return the current app."""
-        current_focus = self.adb_shell(CURRENT_APP_CMD)
+        current_focus = self.adb_shell(self._commands['current_app'])
         if current_focus is None:
             return None
 
         current_focus = current_focus.replace("\r", "")
-        matches = WINDOW_REGEX.search(current_focus)
+        matches = self._current_app_regex.search(current_focus)
 
         # case 1: current app was successfully found
         if matches:
@@ -606,12 +1651,12 @@ class FireTV:
     @property
     def screen_on(self):
         """Check if the screen is on."""
-        return self.adb_shell(SCREEN_ON_CMD + SUCCESS1_FAILURE0) == '1'
+        return self.adb_shell(self._commands['screen_on'] + SUCCESS1_FAILURE0) == '1'
 
     @property
     def awake(self):
         """Check if the device is awake (screensaver is not running)."""
-        return self.adb_shell(AWAKE_CMD + SUCCESS1_FAILURE0) == '1'
+        return self.adb_shell(self._commands['awake'] + SUCCESS1_FAILURE0) == '1'
 
     @property
     def wake_lock(self):
@@ -638,44 +1683,48 @@ class FireTV:
 
     def get_properties(self, get_running_apps=True, lazy=False):
         """Get the ``screen_on``, ``awake``, ``wake_lock_size``, ``current_app``, and ``running_apps`` properties."""
+        if self._helper:
+            output = self.adb_shell(HELPER_CMD.format(int(get_running_apps), int(lazy)))
+
+            # ADB command was unsuccessful
+            if output is None:
+                return None, None, None, None, None
+
+            if output.startswith('screen_on='):
+                return self._parse_helper_output(output, get_running_apps)
+
+            logging.warning("The status helper failed on host: %s; falling back to the inline command", self.host)
+            self._helper = None
+
+        cmds = [self._commands['screen_on'], self._commands['awake'], WAKE_LOCK_SIZE_CMD, self._commands['current_app']]
         if get_running_apps:
-            output = self.adb_shell(SCREEN_ON_CMD + (SUCCESS1 if lazy else SUCCESS1_FAILURE0) + " && " +
-                                    AWAKE_CMD + (SUCCESS1 if lazy else SUCCESS1_FAILURE0) + " && " +
-                                    WAKE_LOCK_SIZE_CMD + " && " +
-                                    CURRENT_APP_CMD + " && " +
-                                    RUNNING_APPS_CMD)
-        else:
-            output = self.adb_shell(SCREEN_ON_CMD + (SUCCESS1 if lazy else SUCCESS1_FAILURE0) + " && " +
-                                    AWAKE_CMD + (SUCCESS1 if lazy else SUCCESS1_FAILURE0) + " && " +
-                                    WAKE_LOCK_SIZE_CMD + " && " +
-                                    CURRENT_APP_CMD)
+            cmds.append(RUNNING_APPS_CMD)
+
+        # when `lazy`, nothing is gathered after the screen is found to be off or the device asleep
+        results = self.adb_shell_many(cmds, stop_on_failure=lazy)
 
         # ADB command was unsuccessful
-        if output is None:
+        if results is None:
             return None, None, None, None, None
 
         # `screen_on` property
-        if not output:
+        if results[0] is None:
             return False, False, -1, None, None
-        screen_on = output[0] == '1'
+        screen_on = results[0]['retcode'] == 0
 
         # `awake` property
-        if len(output) < 2:
+        if results[1] is None:
             return screen_on, False, -1, None, None
-        awake = output[1] == '1'
-
-        lines = output.strip().splitlines()
+        awake = results[1]['retcode'] == 0
 
         # `wake_lock_size` property
-        if len(lines[0]) < 3:
+        matches = WAKE_LOCK_SIZE_REGEX.search(results[2]['output']) if results[2] else None
+        if not matches:
             return screen_on, awake, -1, None, None
-        wake_lock_size = int(lines[0].split("=")[1].strip())
+        wake_lock_size = int(matches.group('size'))
 
         # `current_app` property
-        if len(lines) < 2:
-            return screen_on, awake, wake_lock_size, None, None
-
-        matches = WINDOW_REGEX.search(lines[1])
+        matches = self._current_app_regex.search(results[3]['output']) if results[3] else None
         if matches:
             # case 1: current app was successfully found
             (pkg, activity) = matches.group("package", "activity")
@@ -685,10 +1734,48 @@ class FireTV:
             current_app = None
 
         # `running_apps` property
-        if not get_running_apps or len(lines) < 3:
+        if not get_running_apps or not results[4] or not results[4]['output'].strip():
             return screen_on, awake, wake_lock_size, current_app, None
 
-        running_apps = [line.strip().rsplit(' ', 1)[-1] for line in lines[2:] if line.strip()]
+        running_apps = [line.strip().rsplit(' ', 1)[-1] for line in results[4]['output'].splitlines() if line.strip()]
+
+        return screen_on, awake, wake_lock_size, current_app, running_apps
+
+    def _parse_helper_output(self, output, get_running_apps):
+        """Parse the ``key=value`` output of the status helper script; see `get_properties`."""
+        values = {}
+        running_apps = []
+        for line in output.splitlines():
+            key, _, value = line.strip().partition('=')
+            if key == 'running_app':
+                if value:
+                    running_apps.append(value)
+            else:
+                values[key] = value
+
+        # `screen_on` and `awake` properties
+        screen_on = values.get('screen_on') == '1'
+        if 'awake' not in values:
+            return screen_on, False, -1, None, None
+        awake = values['awake'] == '1'
+
+        # `wake_lock_size` property
+        matches = WAKE_LOCK_SIZE_REGEX.search(values.get('wake_lock', ''))
+        if not matches:
+            return screen_on, awake, -1, None, None
+        wake_lock_size = int(matches.group('size'))
+
+        # `current_app` property
+        matches = self._current_app_regex.search(values.get('current_app', ''))
+        if matches:
+            (pkg, activity) = matches.group("package", "activity")
+            current_app = {"package": pkg, "activity": activity}
+        else:
+            current_app = None
+
+        # `running_apps` property
+        if not get_running_apps or not running_apps:
+            return screen_on, awake, wake_lock_size, current_app, None
 
         return screen_on, awake, wake_lock_size, current_app, running_apps
 
@@ -699,11 +1786,11 @@ class FireTV:
     # ======================================================================= #
     def turn_on(self):
         """Send power action if device is off."""
-        self.adb_shell(SCREEN_ON_CMD + " || (input keyevent {0} && input keyevent {1})".format(POWER, HOME))
+        self.adb_shell(self._commands['screen_on'] + " || (input keyevent {0} && input keyevent {1})".format(POWER, HOME))
 
     def turn_off(self):
         """Send power action if device is not off."""
-        self.adb_shell(SCREEN_ON_CMD + " && input keyevent {0}".format(SLEEP))
+        self.adb_shell(self._commands['screen_on'] + " && input keyevent {0}".format(SLEEP))
 
     # ======================================================================= #
     #                                                                         #
@@ -762,6 +1849,128 @@ class FireTV:
         """Send volume down action."""
         self._key(VOLUME_DOWN)
 
+    def toggle_mute(self):
+        """Send volume mute action (toggles mute)."""
+        self._key(VOLUME_MUTE)
+
+    # ======================================================================= #
+    #                                                                         #
+    #                              volume methods                             #
+    #                                                                         #
+    # ======================================================================= #
+    def _parse_volume(self, output):
+        """Parse `media volume` output and remember the volume and its maximum.
+
+        :param output: The output of ``GET_VOLUME_CMD``.
+        :returns: The volume, or ``None`` if it could not be parsed.
+        """
+        if not output:
+            return None
+
+        matches = VOLUME_REGEX.search(output)
+        if not matches:
+            return None
+
+        self._max_volume = int(matches.group('max'))
+        return int(matches.group('volume'))
+
+    def get_volume(self):
+        """Get the media volume.
+
+        :returns: The volume, or ``None`` if it could not be determined.
+        """
+        return self._parse_volume(self.adb_shell(GET_VOLUME_CMD))
+
+    @property
+    def max_volume(self):
+        """The maximum media volume (known after `get_volume` or `set_volume` succeeds)."""
+        return self._max_volume
+
+    def set_volume(self, level):
+        """Set the media volume with a single command.
+
+        If the device does not support setting the volume directly, the
+        volume keys are pressed instead, all within one ``input`` command.
+
+        :param level: The volume, between 0 and `max_volume`.
+        :returns: The new volume, or ``None`` if it could not be read back from the device.
+        """
+        level = max(0, int(level))
+        if self._max_volume is not None:
+            level = min(level, self._max_volume)
+
+        output = self.adb_shell(SET_VOLUME_CMD.format(level) + "; " + GET_VOLUME_CMD)
+        if output is None:
+            return None
+
+        # the maximum may only be known now, from this command's output
+        volume = self._parse_volume(output)
+        if self._max_volume is not None:
+            level = min(level, self._max_volume)
+        if volume == level:
+            return volume
+
+        # fall back to pressing the volume keys, starting from the volume that
+        # the device reported or else from 0, since the volume may have been
+        # changed with the remote since it was last read
+        if volume is None:
+            keys = [VOLUME_DOWN] * (self._max_volume or DEFAULT_MAX_VOLUME) + [VOLUME_UP] * level
+        elif level > volume:
+            keys = [VOLUME_UP] * (level - volume)
+        else:
+            keys = [VOLUME_DOWN] * (volume - level)
+
+        # one `input` process for all of the keys, since each one starts a JVM
+        output = self.adb_shell("input keyevent {0}; {1}".format(" ".join(str(key) for key in keys), GET_VOLUME_CMD))
+        return self._parse_volume(output)
+
+    @staticmethod
+    def _parse_muted(output):
+        """Parse `GET_MUTED_CMD` output.
+
+        :param output: The output of ``GET_MUTED_CMD``.
+        :returns: Whether the media stream is muted, or ``None`` if it could not be parsed.
+        """
+        if not output:
+            return None
+
+        matches = MUTED_REGEX.search(output)
+        if not matches:
+            return None
+        return matches.group('muted') == 'true'
+
+    def is_muted(self):
+        """Check whether the media stream is muted.
+
+        :returns: Muted or not, or ``None`` if it could not be determined.
+        """
+        return self._parse_muted(self.adb_shell(GET_MUTED_CMD))
+
+    def mute(self, muted=True):
+        """Mute or unmute the media stream.
+
+        If the device does not support muting directly, the mute key is
+        pressed instead, but only if the stream is known to be in the other
+        state, since the key toggles it.
+
+        :param muted: Whether to mute (True) or unmute (False).
+        :returns: Whether the media stream is muted, or ``None`` if it could not be determined.
+        """
+        output = self.adb_shell(SET_MUTED_CMD.format('mute' if muted else 'unmute') + "; " + GET_MUTED_CMD)
+        current = self._parse_muted(output)
+        if current is None or current == muted:
+            return current
+
+        self._key(VOLUME_MUTE)
+        return self.is_muted()
+
+    def unmute(self):
+        """Unmute the media stream.
+
+        :returns: Whether the media stream is muted, or ``None`` if it could not be determined.
+        """
+        return self.mute(False)
+
     # ======================================================================= #
     #                                                                         #
     #                      "key" methods: media commands                      #
@@ -935,3 +2144,138 @@ class FireTV:
     def key_z(self):
         """Send z keypress."""
         self._key(KEY_Z)
+
+
+# ======================================================================= #
+#                                                                         #
+#                    ADB sync protocol (pure-python-adb)                  #
+#                                                                         #
+# ======================================================================= #
+def downscale_png(data, width):
+    """Downscale a PNG image to a width, keeping its aspect ratio.
+
+    :param data: The PNG image.
+    :param width: The width; images that are not wider are returned unchanged.
+    :returns: The PNG image, unchanged if Pillow is not installed.
+    """
+    if Image is None:
+        logging.warning("Pillow is not installed; cannot downscale the screenshot")
+        return data
+
+    image = Image.open(io.BytesIO(data))
+    image_width, image_height = image.size
+    if image_width <= width:
+        return data
+
+    height = max(1, image_height * width // image_width)
+    output = io.BytesIO()
+    image.resize((width, height), Image.BILINEAR).save(output, format='PNG')
+    return output.getvalue()
+
+
+def _decode_chunks(chunks):
+    """Decode a stream of UTF-8 bytes, keeping characters that are split across chunks intact.
+
+    Closing the returned generator closes ``chunks`` as well.
+    """
+    decoder = codecs.getincrementaldecoder('utf8')('replace')
+    try:
+        for chunk in chunks:
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+    finally:
+        chunks.close()
+
+
+def _open_service(device, service, timeout=None):
+    """Open a connection to an ADB service (e.g., ``sync:``) on a pure-python-adb device.
+
+    :param device: The pure-python-adb device.
+    :param service: The service.
+    :param timeout: The socket timeout (in seconds) for the connection, or ``None`` for the default.
+    """
+    connection = device.create_connection() if timeout is None else device.create_connection(timeout=timeout)
+    try:
+        connection.send(service)
+    except Exception:
+        connection.close()
+        raise
+    return connection
+
+
+def _sync_read(connection, length):
+    """Read exactly ``length`` bytes from an ADB server connection."""
+    data = b''
+    while len(data) < length:
+        chunk = connection.read(length - len(data))
+        if not chunk:
+            raise IOError("ADB sync connection closed unexpectedly")
+        data += chunk
+    return data
+
+
+def _sync_request(connection, command, path):
+    """Send a sync request (e.g., ``SEND``, ``RECV``, or ``STAT``) for ``path``."""
+    path = path.encode('utf8')
+    connection.write(command + struct.pack('<I', len(path)) + path)
+
+
+def _sync_fail(connection, length):
+    """Raise the error message that follows a ``FAIL`` response."""
+    raise IOError(_sync_read(connection, length).decode('utf8', 'replace'))
+
+
+def _sync_push(connection, stream, device_path, progress_callback=None):
+    """Push ``stream`` to ``device_path`` over a connection in sync mode."""
+    total = None
+    if progress_callback:
+        position = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        total = stream.tell() - position
+        stream.seek(position)
+
+    _sync_request(connection, b'SEND', '{0},{1}'.format(device_path, PUSH_MODE))
+
+    written = 0
+    chunk = stream.read(CHUNK_SIZE)
+    while chunk:
+        connection.write(b'DATA' + struct.pack('<I', len(chunk)))
+        connection.write(chunk)
+        written += len(chunk)
+        if progress_callback:
+            progress_callback(device_path, written, total)
+        chunk = stream.read(CHUNK_SIZE)
+
+    connection.write(b'DONE' + struct.pack('<I', int(time.time())))
+
+    response, length = struct.unpack('<4sI', _sync_read(connection, 8))
+    if response == b'FAIL':
+        _sync_fail(connection, length)
+
+
+def _sync_pull(connection, device_path, stream, progress_callback=None):
+    """Pull ``device_path`` into ``stream`` over a connection in sync mode."""
+    total = None
+    if progress_callback:
+        _sync_request(connection, b'STAT', device_path)
+        _, _, total, _ = struct.unpack('<4sIII', _sync_read(connection, 16))
+
+    _sync_request(connection, b'RECV', device_path)
+
+    read = 0
+    while True:
+        response, length = struct.unpack('<4sI', _sync_read(connection, 8))
+        if response == b'DONE':
+            return
+        if response == b'FAIL':
+            _sync_fail(connection, length)
+
+        stream.write(_sync_read(connection, length))
+        read += length
+        if progress_callback:
+            progress_callback(device_path, read, total)
@@ -19,22 +19,118 @@ Find device IP:
 """
 
 import argparse
+import collections
+import io
+import json
 import os
 import re
+import signal
+import socket
+import threading
+import time
 from os.path import expanduser
 
 import yaml
 import logging
-from flask import Flask, jsonify, request, abort
-from firetv import FireTV
+from flask import Flask, Response, g, jsonify, request, abort
+from firetv import DeadlineExceededError, FireTV, deadline, downscale_png, remaining_time, transport_available, LOGCAT_PRIORITIES, LOGCAT_TAG_REGEX, LOGCAT_TIME_REGEX, STATE_UNKNOWN, TRANSPORTS
+from firetv.discovery import ADB_PORT, discover
+from firetv.history import StateHistory
+from firetv.scheduler import PollScheduler
+from firetv.state import DeviceState
+from firetv.statefile import StateFileWriter
+from firetv.webhooks import WebhookDispatcher
+
+# MessagePack is only needed for binary `/devices/status` responses
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 
 app = Flask(__name__)
+
+# device_id -> FireTV; a copy-on-write snapshot that is replaced (never mutated)
+# while holding `devices_lock`, so readers can use it without locking
 devices = {}
+devices_lock = threading.Lock()
 config_data = None
 valid_device_id = re.compile('^[-\w]+$')
 valid_app_id = re.compile('^[A-Za-z0-9\.]+$')
 
+# How long (in seconds) a screenshot is served from the cache
+SCREENSHOT_TTL = 2.
+
+# The widths that screenshots are downscaled to; other widths are rounded up
+# to the next one, so that the cache holds a few images per device at most
+SCREENSHOT_WIDTHS = (320, 480, 640, 960, 1280, 1920)
+
+# device_id -> (timestamp, {width: PNG bytes}), where the full-size capture has
+# the width `None` and the others are downscaled from it
+screenshots = {}
+screenshot_locks = {}
+screenshot_locks_lock = threading.Lock()
+
+# The version of the snapshot file format
+SNAPSHOT_VERSION = 1
+
+# Where a device was added from: the config file (or `--default`), or the API
+ORIGIN_CONFIG = 'config'
+ORIGIN_API = 'api'
+
+# The number of lines kept in each logcat ring buffer
+LOGCAT_BUFFER_LINES = 1000
+
+# How often (in seconds) new logcat lines are fetched from a device
+LOGCAT_POLL_INTERVAL = 1.
+
+# How often (in seconds) something is sent to a logcat client while no lines
+# match, so that a client that disconnected is noticed and releases the buffer
+LOGCAT_KEEPALIVE_INTERVAL = 15.
+
+# The maximum number of devices queried at the same time by `/devices/status`
+STATUS_WORKERS = 16
+
+# The maximum number of devices that `/devices/install` installs on at the same time
+INSTALL_WORKERS = 8
+
+# The content type of MessagePack responses
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+# (device_id, filters, priority) -> LogcatBuffer
+logcat_buffers = {}
+logcat_buffers_lock = threading.Lock()
+
+# device_id -> the arguments that the device was added with
+registry = {}
+
+# device_id -> where the device was added from (`ORIGIN_CONFIG` or `ORIGIN_API`)
+origins = {}
+
+# device_id -> the most recent poll result and when it was gathered
+last_results = {}
+
+# publishes state and app changes found by polling when webhooks are configured
+webhooks = None
+
+# publishes poll results to a memory-mapped file when the server is run with `--state-file`
+state_file = None
+
+# device_id -> StateHistory of the polled state transitions
+histories = {}
+
+# device_id -> snapshot entry, for devices that have not been re-added since the server started
+stale_devices = {}
+
+# polls devices in the background when the server is run with `--poll`
+scheduler = None
+
+# device_id -> the arguments of the devices that were added from the config file
+config_devices = {}
+
+# set to make the config watcher reload the config file
+config_reload = threading.Event()
+
 
 def is_valid_host(host):
     """ Check if host is valid.
@@ -78,7 +174,32 @@ def is_valid_app_id(app_id):
     return valid_app_id.match(app_id)
 
 
-def add(device_id, host, adbkey='', adb_server_ip='', adb_server_port=5037):
+@app.before_request
+def _start_deadline():
+    """ Bound the ADB commands of a request by its ``timeout_ms`` query parameter. """
+    timeout_ms = request.args.get('timeout_ms', type=float)
+    if timeout_ms is not None:
+        g.deadline = deadline(timeout_ms / 1000.)
+        g.deadline.__enter__()
+
+
+@app.teardown_request
+def _end_deadline(exc):
+    """ End the deadline started by `_start_deadline`. """
+    request_deadline = getattr(g, 'deadline', None)
+    if request_deadline is not None:
+        request_deadline.__exit__(None, None, None)
+
+
+@app.errorhandler(DeadlineExceededError)
+def _deadline_exceeded(err):
+    """ Respond with 504 Gateway Timeout when a request's deadline expires. """
+    response = jsonify(success=False, error=str(err))
+    response.status_code = 504
+    return response
+
+
+def add(device_id, host, adbkey='', adb_server_ip='', adb_server_port=5037, transport=None, origin=ORIGIN_API):
     """ Add a device.
 
     Creates FireTV instance associated with device identifier.
@@ -88,12 +209,91 @@ def add(device_id, host, adbkey='', adb_server_ip='', adb_server_port=5037):
     :param adbkey: The path to the "adbkey" file
     :param adb_server_ip: the IP address for the ADB server
     :param adb_server_port: the port for the ADB server
+    :param transport: the ADB transport (see ``firetv.TRANSPORTS``); chosen automatically by default
+    :param origin: where the device was added from (``ORIGIN_CONFIG`` or ``ORIGIN_API``)
     :returns: Added successfully or not.
     """
-    valid = is_valid_device_id(device_id) and is_valid_host(host)
-    if valid:
-        devices[device_id] = FireTV(str(host), str(adbkey), str(adb_server_ip), str(adb_server_port))
-    return valid
+    global devices
+    if isinstance(adb_server_ip, (list, tuple)):
+        adb_server_ip = ','.join(adb_server_ip)
+    valid = is_valid_device_id(device_id) and is_valid_host(host) and (transport is None or transport in TRANSPORTS)
+    if not valid:
+        return False
+    if transport is not None and not transport_available(transport):
+        logging.error("Can't add device %s: transport %s is not installed", device_id, transport)
+        return False
+
+    args = {'host': host, 'adbkey': adbkey, 'adb_server_ip': adb_server_ip, 'adb_server_port': adb_server_port, 'transport': transport}
+
+    # adding the same device again is a no-op
+    if registry.get(device_id) == args and device_id in devices:
+        origins[device_id] = origin
+        return True
+
+    # connect outside of the lock, so that slow devices don't hold up other changes
+    try:
+        device = FireTV(str(host), str(adbkey), str(adb_server_ip), str(adb_server_port), transport)
+    except ValueError as err:
+        # e.g. no transport is installed
+        logging.error("Can't add device %s: %s", device_id, err)
+        return False
+
+    with devices_lock:
+        origins[device_id] = origin
+        if registry.get(device_id) == args and device_id in devices:
+            # a concurrent add of the same device won
+            replaced = device
+        else:
+            replaced = devices.get(device_id)
+            new_devices = dict(devices)
+            new_devices[device_id] = device
+            devices = new_devices
+            registry[device_id] = args
+            stale_devices.pop(device_id, None)
+            if scheduler:
+                scheduler.add(device_id, device)
+
+    if replaced is not None:
+        if replaced is not device:
+            # the buffers use the replaced connection
+            _stop_logcat_buffers(device_id)
+        replaced.close()
+    return True
+
+
+def remove(device_id):
+    """ Remove a device and close its ADB connection.
+
+    :param device_id: Device identifier.
+    :returns: Removed successfully or not.
+    """
+    global devices
+    with devices_lock:
+        device = devices.get(device_id)
+        if device is not None:
+            new_devices = dict(devices)
+            del new_devices[device_id]
+            devices = new_devices
+        registry.pop(device_id, None)
+        origins.pop(device_id, None)
+        last_results.pop(device_id, None)
+        histories.pop(device_id, None)
+        stale = stale_devices.pop(device_id, None)
+        if scheduler:
+            scheduler.remove(device_id)
+        if state_file:
+            state_file.remove(device_id)
+
+    _stop_logcat_buffers(device_id)
+
+    with screenshot_locks_lock:
+        screenshot_locks.pop(device_id, None)
+        screenshots.pop(device_id, None)
+
+    if device is None:
+        return stale is not None
+    device.close()
+    return True
 
 
 @app.route('/devices/add', methods=['POST'])
@@ -112,10 +312,59 @@ def add_device():
     req = request.get_json()
     success = False
     if 'device_id' in req and 'host' in req:
-        success = add(req['device_id'], req['host'], req.get('adbkey', ''), req.get('adb_server_ip', ''), req.get('adb_server_port', 5037))
+        success = add(req['device_id'], req['host'], req.get('adbkey', ''), req.get('adb_server_ip', ''), req.get('adb_server_port', 5037), req.get('transport'))
     return jsonify(success=success)
 
 
+@app.route('/devices/<device_id>', methods=['DELETE'])
+def delete_device(device_id):
+    """ Remove a device and close its ADB connection via HTTP DELETE. """
+    if not is_valid_device_id(device_id):
+        abort(403)
+    if not remove(device_id):
+        abort(404)
+    return jsonify(success=True)
+
+
+@app.route('/devices/discover', methods=['POST'])
+def discover_devices():
+    """ Discover Fire TV devices via HTTP POST.
+
+    POST JSON in the following format ::
+
+        {
+            "cidr": "<address>/<prefix length>",
+            "port": 5555,
+            "register": false,
+            "firetv_only": true
+        }
+
+    Devices that require ADB authentication can't be identified by their
+    reply, so they are reported with ``"firetv": null``; ``firetv_only``
+    only excludes devices that are identified as something else.  If
+    ``register`` is true, discovered devices that are not registered yet
+    are added with a device identifier derived from their address.
+    """
+    req = request.get_json()
+    if not req or 'cidr' not in req:
+        abort(400)
+
+    try:
+        found = discover(req['cidr'], port=int(req.get('port', ADB_PORT)), firetv_only=bool(req.get('firetv_only', True)))
+    except (ValueError, OSError, socket.error):
+        abort(400)
+
+    if req.get('register'):
+        known_hosts = set(device.host for device in list(devices.values()))
+        for result in found:
+            if result['host'] not in known_hosts:
+                device_id = 'firetv-' + result['host'].partition(':')[0].replace('.', '-')
+                result['device_id'] = device_id
+                result['registered'] = add(device_id, result['host'])
+
+    return jsonify(devices=found)
+
+
 @app.route('/devices/list', methods=['GET'])
 def list_devices():
     """ List devices via HTTP GET. """
@@ -125,15 +374,119 @@ def list_devices():
             'host': device.host,
             'state': device.state
         }
+    for device_id, entry in list(stale_devices.items()):
+        if device_id not in output:
+            output[device_id] = {
+                'host': entry['host'],
+                'state': entry.get('state', STATE_UNKNOWN),
+                'stale': True
+            }
+    return jsonify(devices=output)
+
+
+def _device_status(device, fields):
+    """ Gather only the requested `update()` fields of a device. """
+    if not device.available:
+        return {field: STATE_UNKNOWN if field == 'state' else None for field in fields}
+
+    if 'state' in fields:
+        status = dict(zip(DeviceState.FIELDS, device.update(get_running_apps='running_apps' in fields)))
+    else:
+        status = {}
+        if 'current_app' in fields:
+            current = device.current_app
+            status['current_app'] = current['package'] if current else None
+        if 'running_apps' in fields:
+            status['running_apps'] = device.running_apps
+    return {field: status[field] for field in fields}
+
+
+@app.route('/devices/status', methods=['GET'])
+def devices_status():
+    """ Get the state, current app and running apps of many devices in one response.
+
+    Query parameters:
+
+    * ``ids``: comma-separated device identifiers (default: all devices)
+    * ``fields``: comma-separated subset of ``state``, ``current_app`` and
+      ``running_apps`` (default: all); only these are gathered from the devices
+    * ``format``: ``json`` (default) or ``msgpack``; an ``Accept`` header of
+      ``application/x-msgpack`` also selects MessagePack
+    """
+    fields = request.args.get('fields')
+    fields = fields.split(',') if fields else list(DeviceState.FIELDS)
+    if any(field not in DeviceState.FIELDS for field in fields):
+        abort(400)
+
+    current_devices = devices
+    device_ids = request.args.get('ids')
+    if device_ids:
+        device_ids = device_ids.split(',')
+        if not all(is_valid_device_id(device_id) for device_id in device_ids):
+            abort(403)
+    else:
+        device_ids = list(current_devices) + [device_id for device_id in stale_devices if device_id not in current_devices]
+
+    use_msgpack = request.args.get('format') == 'msgpack' or request.accept_mimetypes.best == MSGPACK_MIMETYPE
+    if use_msgpack and msgpack is None:
+        abort(406)
+
+    output = {}
+    pending = collections.deque()
+    for device_id in device_ids:
+        if device_id in current_devices:
+            pending.append((device_id, current_devices[device_id]))
+        elif device_id in stale_devices:
+            entry = stale_devices[device_id]
+            output[device_id] = {field: entry.get(field, STATE_UNKNOWN if field == 'state' else None) for field in fields}
+            output[device_id]['stale'] = True
+
+    # the workers share the request's deadline, so the whole request is bounded by it
+    timeout = remaining_time()
+    end = None if timeout is None else time.time() + timeout
+
+    def _worker():
+        while True:
+            try:
+                device_id, device = pending.popleft()
+            except IndexError:
+                return
+            try:
+                if end is None:
+                    output[device_id] = _device_status(device, fields)
+                elif end <= time.time():
+                    output[device_id] = {'timeout': True}
+                else:
+                    with deadline(end - time.time()):
+                        output[device_id] = _device_status(device, fields)
+            except DeadlineExceededError:
+                output[device_id] = {'timeout': True}
+            except Exception as err:  # pylint: disable=broad-except
+                logging.error("Couldn't get the status of device %s: %s", device_id, err)
+                output[device_id] = {'error': str(err)}
+
+    threads = [threading.Thread(target=_worker) for _ in range(min(STATUS_WORKERS, len(pending)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if use_msgpack:
+        return Response(msgpack.packb({'devices': output}), mimetype=MSGPACK_MIMETYPE)
     return jsonify(devices=output)
 
 
 @app.route('/devices/state/<device_id>', methods=['GET'])
 def device_state(device_id):
     """ Get device state via HTTP GET. """
-    if device_id not in devices:
+    device = devices.get(device_id)
+    if device is None:
+        entry = stale_devices.get(device_id)
+        if entry:
+            return jsonify(state=entry.get('state', STATE_UNKNOWN), stale=True)
         return jsonify(success=False)
-    return jsonify(state=devices[device_id].state)
+    return jsonify(state=device.state)
 
 
 @app.route('/devices/<device_id>/apps/current', methods=['GET'])
@@ -141,10 +494,11 @@ def current_app(device_id):
     """ Get currently running app. """
     if not is_valid_device_id(device_id):
         abort(403)
-    if device_id not in devices:
+    device = devices.get(device_id)
+    if device is None:
         abort(404)
 
-    current = devices[device_id].current_app
+    current = device.current_app
     if current is None:
         abort(404)
 
@@ -156,9 +510,10 @@ def running_apps(device_id):
     """ Get running apps via HTTP GET. """
     if not is_valid_device_id(device_id):
         abort(403)
-    if device_id not in devices:
+    device = devices.get(device_id)
+    if device is None:
         abort(404)
-    return jsonify(running_apps=devices[device_id].running_apps)
+    return jsonify(running_apps=device.running_apps)
 
 
 @app.route('/devices/<device_id>/apps/state/<app_id>', methods=['GET'])
@@ -168,9 +523,10 @@ def get_app_state(device_id, app_id):
         abort(403)
     if not is_valid_device_id(device_id):
         abort(403)
-    if device_id not in devices:
+    device = devices.get(device_id)
+    if device is None:
         abort(404)
-    app_state = devices[device_id].app_state(app_id)
+    app_state = device.app_state(app_id)
     return jsonify(state=app_state, status=app_state)
 
 
@@ -183,8 +539,9 @@ def get_app_state_alt(device_id, app_id):
 def device_action(device_id, action_id):
     """ Initiate device action via HTTP GET. """
     success = False
-    if device_id in devices:
-        input_cmd = getattr(devices[device_id], action_id, None)
+    device = devices.get(device_id)
+    if device is not None:
+        input_cmd = getattr(device, action_id, None)
         if callable(input_cmd):
             input_cmd()
             success = True
@@ -198,10 +555,11 @@ def app_start(device_id, app_id):
         abort(403)
     if not is_valid_device_id(device_id):
         abort(403)
-    if device_id not in devices:
+    device = devices.get(device_id)
+    if device is None:
         abort(404)
 
-    success = devices[device_id].launch_app(app_id)
+    success = device.launch_app(app_id)
     return jsonify(success=success)
 
 
@@ -212,23 +570,488 @@ def app_stop(device_id, app_id):
         abort(403)
     if not is_valid_device_id(device_id):
         abort(403)
-    if device_id not in devices:
+    device = devices.get(device_id)
+    if device is None:
         abort(404)
 
-    success = devices[device_id].stop_app(app_id)
+    success = device.stop_app(app_id)
     return jsonify(success=success)
 
 
+@app.route('/devices/<device_id>/screenshot', methods=['GET'])
+def screenshot(device_id):
+    """ Get a PNG screenshot via HTTP GET.
+
+    The optional ``width`` query parameter downscales the image; it is rounded
+    up to one of ``SCREENSHOT_WIDTHS``, and widths above the largest return the
+    full image.  One full-size screenshot per device is cached for
+    ``SCREENSHOT_TTL`` seconds, and every width is downscaled from it, so
+    concurrent requests for the same device wait for a single capture rather
+    than each taking their own.  A full-size capture is streamed to the
+    client that requested it as it is transferred.
+    """
+    if not is_valid_device_id(device_id):
+        abort(403)
+    device = devices.get(device_id)
+    if device is None:
+        abort(404)
+
+    width = request.args.get('width', type=int)
+    if width is not None:
+        if width <= 0:
+            abort(400)
+        width = next((allowed for allowed in SCREENSHOT_WIDTHS if allowed >= width), None)
+
+    with screenshot_locks_lock:
+        lock = screenshot_locks.setdefault(device_id, threading.Lock())
+
+    lock.acquire()
+    streaming = False
+    try:
+        cached = screenshots.get(device_id)
+        if cached and time.time() - cached[0] < SCREENSHOT_TTL:
+            images = cached[1]
+        elif width is None:
+            # stream the capture, and cache it once it is complete; the lock
+            # is held until then, so that concurrent requests use the cache
+            chunks = device.screencap_stream()
+            first = next(chunks, None)
+            if not first:
+                abort(404)
+
+            def _stream():
+                data = [first]
+                try:
+                    yield first
+                    for chunk in chunks:
+                        data.append(chunk)
+                        yield chunk
+                    screenshots[device_id] = (time.time(), {None: b''.join(data)})
+                finally:
+                    chunks.close()
+                    lock.release()
+
+            streaming = True
+            return Response(_stream(), mimetype='image/png')
+        else:
+            image = device.screencap()
+            if image is None:
+                abort(404)
+            images = {None: image}
+            screenshots[device_id] = (time.time(), images)
+
+        if width not in images:
+            images[width] = downscale_png(images[None], width)
+        image = images[width]
+    finally:
+        if not streaming:
+            lock.release()
+
+    return Response(image, mimetype='image/png')
+
+
+@app.route('/devices/<device_id>/ui', methods=['GET'])
+def ui_tree(device_id):
+    """ Get the UI elements on screen via HTTP GET.
+
+    The optional ``text`` (text or content description) and ``focused``
+    (``true``/``false``) query parameters limit the result to matching elements.
+    """
+    if not is_valid_device_id(device_id):
+        abort(403)
+    device = devices.get(device_id)
+    if device is None:
+        abort(404)
+
+    tree = device.ui_tree()
+    if tree is None:
+        abort(404)
+
+    focused = request.args.get('focused')
+    if focused is not None:
+        focused = focused.lower() in ('1', 'true')
+    nodes = tree.find(text=request.args.get('text'), focused=focused)
+    return jsonify(nodes=[dict(node._asdict()) for node in nodes])
+
+
+@app.route('/devices/install', methods=['POST'])
+def install():
+    """ Install an APK on many devices via HTTP POST.
+
+    POST a ``multipart/form-data`` body with the APK in the ``apk`` field and
+    optionally one or more ``device_id`` fields (default: all devices).  The
+    upload is read once and every device streams from the same buffer.
+    """
+    if 'apk' not in request.files:
+        abort(400)
+
+    current_devices = devices
+    device_ids = request.form.getlist('device_id') or list(current_devices.keys())
+    for device_id in device_ids:
+        if not is_valid_device_id(device_id):
+            abort(403)
+        if device_id not in current_devices:
+            abort(404)
+
+    upload = request.files['apk']
+    name = os.path.basename(upload.filename or '') or 'firetv.apk'
+    data = upload.read()
+    results = dict((device_id, False) for device_id in device_ids)
+    pending = collections.deque(device_ids)
+
+    def _worker():
+        while True:
+            try:
+                device_id = pending.popleft()
+            except IndexError:
+                return
+            stream = io.BytesIO(data)
+            stream.name = name
+            try:
+                output = current_devices[device_id].install_apk(stream)
+            except Exception as err:  # pylint: disable=broad-except
+                logging.error("Couldn't install %r on device %s: %s", name, device_id, err)
+                continue
+            results[device_id] = output is not None and 'Success' in output
+
+    threads = [threading.Thread(target=_worker) for _ in range(min(INSTALL_WORKERS, len(device_ids)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return jsonify(success=all(results.values()), devices=results)
+
+
+class LogcatBuffer(object):
+    """ A ring buffer of logcat lines fetched from a device in the background.
+
+    All clients streaming the same device and filters share one buffer.  Lines
+    are fetched incrementally with ``logcat -d -T`` so that the device stays
+    available for other commands, and a client that falls more than
+    ``LOGCAT_BUFFER_LINES`` lines behind skips the lines it missed rather than
+    holding up the device.  Removing the device stops the buffer and ends its
+    clients' streams.
+    """
+
+    def __init__(self, key, device, filters, priority):
+        self.key = key
+        self.device = device
+        self.filters = filters
+        self.priority = priority
+        self.lines = collections.deque(maxlen=LOGCAT_BUFFER_LINES)
+        self.next_seq = 0
+        self.clients = 0
+        self.stopped = False
+        self.cond = threading.Condition()
+
+    def start(self):
+        thread = threading.Thread(target=self._fetch_loop)
+        thread.daemon = True
+        thread.start()
+
+    def _fetch_loop(self):
+        since = None
+        seen = set()
+        while True:
+            with self.cond:
+                if not self.clients or self.stopped:
+                    return
+
+            try:
+                for line in self.device.logcat(self.filters, self.priority, since):
+                    timestamp = line[:18]
+                    if not LOGCAT_TIME_REGEX.match(timestamp):
+                        continue
+
+                    # `-T` includes the lines at the previous timestamp
+                    if timestamp == since and line in seen:
+                        continue
+                    if timestamp != since:
+                        since = timestamp
+                        seen = set()
+                    seen.add(line)
+
+                    with self.cond:
+                        self.lines.append((self.next_seq, line))
+                        self.next_seq += 1
+                        self.cond.notify_all()
+            except Exception as err:  # pylint: disable=broad-except
+                logging.warning("Couldn't read logcat from host: %s, error: %s", self.device.host, err)
+
+            time.sleep(LOGCAT_POLL_INTERVAL)
+
+    def stop(self):
+        """ Stop fetching lines and end the clients' streams. """
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def stream(self):
+        """ Yield ``(dropped, line)`` pairs, where ``dropped`` counts the lines skipped before ``line``.
+
+        If no line arrives for ``LOGCAT_KEEPALIVE_INTERVAL`` seconds, ``(0, None)`` is yielded.
+        """
+        with self.cond:
+            cursor = self.next_seq
+        last_yield = time.time()
+
+        try:
+            while True:
+                with self.cond:
+                    if self.next_seq <= cursor and not self.stopped:
+                        self.cond.wait(LOGCAT_POLL_INTERVAL)
+                    if self.stopped:
+                        return
+                    pending = [(seq, line) for seq, line in self.lines if seq >= cursor]
+
+                for seq, line in pending:
+                    yield seq - cursor, line
+                    cursor = seq + 1
+                    last_yield = time.time()
+
+                if time.time() - last_yield >= LOGCAT_KEEPALIVE_INTERVAL:
+                    yield 0, None
+                    last_yield = time.time()
+        finally:
+            _release_logcat_buffer(self)
+
+
+def _acquire_logcat_buffer(device_id, device, filters, priority):
+    """ Get the shared logcat buffer for a device and filters, starting it if necessary. """
+    key = (device_id, tuple(sorted(filters.items())), priority)
+    with logcat_buffers_lock:
+        buf = logcat_buffers.get(key)
+        if buf is None:
+            buf = logcat_buffers[key] = LogcatBuffer(key, device, filters, priority)
+        with buf.cond:
+            buf.clients += 1
+            start = buf.clients == 1
+    if start:
+        buf.start()
+    return buf
+
+
+def _stop_logcat_buffers(device_id):
+    """ Stop the logcat buffers of a device. """
+    with logcat_buffers_lock:
+        stopped = [buf for key, buf in logcat_buffers.items() if key[0] == device_id]
+        for buf in stopped:
+            del logcat_buffers[buf.key]
+    for buf in stopped:
+        buf.stop()
+
+
+def _release_logcat_buffer(buf):
+    """ Stop sharing a logcat buffer; the last client to leave stops it. """
+    with logcat_buffers_lock:
+        with buf.cond:
+            buf.clients -= 1
+            if not buf.clients and logcat_buffers.get(buf.key) is buf:
+                del logcat_buffers[buf.key]
+
+
+@app.route('/devices/<device_id>/logcat', methods=['GET'])
+def logcat(device_id):
+    """ Stream the device log via HTTP GET.
+
+    Query parameters:
+        - ``filter``: ``<tag>:<priority>``; may be repeated
+        - ``priority``: minimum priority of lines with other tags
+        - ``format``: ``sse`` for server-sent events, otherwise plain text
+    """
+    if not is_valid_device_id(device_id):
+        abort(403)
+    device = devices.get(device_id)
+    if device is None:
+        abort(404)
+
+    filters = {}
+    for spec in request.args.getlist('filter'):
+        tag, _, tag_priority = spec.partition(':')
+        if not LOGCAT_TAG_REGEX.match(tag) or tag_priority not in LOGCAT_PRIORITIES:
+            abort(400)
+        filters[tag] = tag_priority
+
+    priority = request.args.get('priority')
+    if priority is not None and priority not in LOGCAT_PRIORITIES:
+        abort(400)
+
+    sse = request.args.get('format') == 'sse'
+    buf = _acquire_logcat_buffer(device_id, device, filters, priority)
+
+    def _generate():
+        for dropped, line in buf.stream():
+            if line is None:
+                # a keepalive; writing something is how a disconnect is noticed
+                yield ': keepalive\n\n' if sse else '\n'
+            elif sse:
+                if dropped:
+                    yield ': dropped {0} lines\n\n'.format(dropped)
+                yield 'data: {0}\n\n'.format(line)
+            else:
+                yield line + '\n'
+
+    return Response(_generate(), mimetype='text/event-stream' if sse else 'text/plain')
+
+
+@app.route('/devices/<device_id>/volume', methods=['GET'])
+def get_volume(device_id):
+    """ Get the media volume via HTTP GET. """
+    if not is_valid_device_id(device_id):
+        abort(403)
+    device = devices.get(device_id)
+    if device is None:
+        abort(404)
+
+    volume = device.get_volume()
+    return jsonify(success=volume is not None, volume=volume, max_volume=device.max_volume)
+
+
+@app.route('/devices/<device_id>/volume/<int:level>', methods=['GET'])
+def set_volume(device_id, level):
+    """ Set the media volume via HTTP GET. """
+    if not is_valid_device_id(device_id):
+        abort(403)
+    device = devices.get(device_id)
+    if device is None:
+        abort(404)
+
+    volume = device.set_volume(level)
+    return jsonify(success=volume is not None, volume=volume, max_volume=device.max_volume)
+
+
+@app.route('/devices/<device_id>/history', methods=['GET'])
+def history(device_id):
+    """ Get the polled state transitions of a device via HTTP GET.
+
+    The optional ``since`` query parameter (seconds since the epoch) limits the
+    result to the transitions since then, including the one in effect at that time.
+    """
+    if not is_valid_device_id(device_id):
+        abort(403)
+    device = devices.get(device_id)
+    if device is None:
+        abort(404)
+
+    since = request.args.get('since', 0, type=float)
+    transitions = histories[device_id].since(since) if device_id in histories else []
+    return jsonify(history=[{'time': timestamp, 'state': state, 'current_app': current}
+                            for timestamp, state, current in transitions])
+
+
 @app.route('/devices/connect/<device_id>', methods=['GET'])
 def device_connect(device_id):
     """ Force a connection attempt via HTTP GET. """
     success = False
-    if device_id in devices:
-        devices[device_id].connect()
+    device = devices.get(device_id)
+    if device is not None:
+        device.connect()
         success = True
     return jsonify(success=success)
 
 
+def _on_poll(device_id, result, previous):
+    """ Record a poll result from the scheduler. """
+    state, current, running = result
+    now = time.time()
+    last_results[device_id] = {'state': state, 'current_app': current, 'running_apps': running,
+                               'available': state != STATE_UNKNOWN, 'updated': now}
+
+    history = histories.get(device_id)
+    if history is None:
+        history = histories.setdefault(device_id, StateHistory())
+    history.record(now, state, current)
+
+    if state_file:
+        state_file.publish(device_id, state, current, running, now)
+
+    if webhooks and previous is not None and (state, current) != tuple(previous[:2]):
+        webhooks.publish({'device_id': device_id, 'time': now, 'state': state, 'current_app': current,
+                          'previous': {'state': previous[0], 'current_app': previous[1]}})
+
+
+def _save_snapshot(path, previous=None):
+    """ Atomically write the device registry and last poll results to a file.
+
+    :param path: The snapshot file.
+    :param previous: The previously written snapshot; nothing is written if it is unchanged.
+    :returns: The written snapshot.
+    """
+    entries = dict(stale_devices)
+    for device_id, args in list(registry.items()):
+        entry = dict(args)
+        entry['origin'] = origins.get(device_id, ORIGIN_API)
+        entry.update(last_results.get(device_id, {}))
+        entries[device_id] = entry
+
+    snapshot = json.dumps({'version': SNAPSHOT_VERSION, 'devices': entries}, separators=(',', ':'), sort_keys=True)
+    if snapshot == previous:
+        return snapshot
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as snapshot_file:
+        snapshot_file.write(snapshot)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    if hasattr(os, 'replace'):
+        os.replace(tmp_path, path)
+    else:
+        os.rename(tmp_path, path)
+    return snapshot
+
+
+def _load_snapshot(path):
+    """ Load the devices from a snapshot file as stale devices. """
+    try:
+        with open(path, 'r') as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except (IOError, OSError, ValueError) as err:
+        logging.warning("Couldn't load snapshot %s: %s", path, err)
+        return
+
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        logging.warning("Ignoring snapshot %s with unsupported version %s", path, snapshot.get('version'))
+        return
+
+    stale_devices.update(snapshot.get('devices', {}))
+
+
+def _snapshot_loop(path, interval):
+    """ Periodically write the snapshot file. """
+    previous = None
+    while True:
+        time.sleep(interval)
+        try:
+            previous = _save_snapshot(path, previous)
+        except (IOError, OSError) as err:
+            logging.warning("Couldn't write snapshot %s: %s", path, err)
+
+
+def _add_devices_from_snapshot(configured):
+    """ Reconnect the devices from the snapshot that were not added otherwise.
+
+    Devices that came from the config file but are no longer in it are
+    dropped rather than reconnected; devices added through the API are kept.
+
+    :param configured: The identifiers of the devices in the current config (and `--default`).
+    """
+    for device_id, entry in list(stale_devices.items()):
+        if device_id in devices:
+            continue
+
+        origin = entry.get('origin', ORIGIN_API)
+        if origin == ORIGIN_CONFIG and device_id not in configured:
+            logging.info("Not restoring device %s, which was removed from the config", device_id)
+            with devices_lock:
+                stale_devices.pop(device_id, None)
+            continue
+
+        add(device_id, entry['host'], entry.get('adbkey', ''), entry.get('adb_server_ip', ''), entry.get('adb_server_port', 5037),
+            entry.get('transport'), origin)
+
+
 def _parse_config(config_file_path):
     """ Parse Config File from yaml file. """
     config_file = open(config_file_path, 'r')
@@ -237,29 +1060,114 @@ def _parse_config(config_file_path):
     return config
 
 
-def _add_devices_from_config(args):
-    """ Add devices from config. """
+def _devices_from_config(args):
+    """ Get the devices in the config file as a dictionary of `add()` arguments. """
     config = _parse_config(args.config)
+    config_args = {}
     for device in config['devices']:
         if args.default:
             if device == "default":
                 raise ValueError('devicename "default" in config is not allowed if default param is set')
             if config['devices'][device]['host'] == args.default:
                 raise ValueError('host set in default param must not be defined in config')
-        add(device, config['devices'][device]['host'], config['devices'][device].get('adbkey', ''),
-            config['devices'][device].get('adb_server_ip', ''), config['devices'][device].get('adb_server_port', 5037))
+        config_args[device] = {'host': config['devices'][device]['host'],
+                               'adbkey': config['devices'][device].get('adbkey', ''),
+                               'adb_server_ip': config['devices'][device].get('adb_server_ip', ''),
+                               'adb_server_port': config['devices'][device].get('adb_server_port', 5037),
+                               'transport': config['devices'][device].get('transport')}
+    return config_args
+
+
+def _add_devices_from_config(args):
+    """ Add devices from config.
+
+    When called again, only the devices that were added, removed, or changed
+    in the config file since the last call are added, removed, or re-created;
+    the connections to unchanged devices are left intact.
+    """
+    new_devices = _devices_from_config(args)
+
+    for device_id, device_args in list(config_devices.items()):
+        if new_devices.get(device_id) != device_args:
+            remove(device_id)
+            del config_devices[device_id]
+
+    for device_id, device_args in new_devices.items():
+        if device_id not in config_devices:
+            if add(device_id, origin=ORIGIN_CONFIG, **device_args):
+                config_devices[device_id] = device_args
+
+
+def _watch_config(args, interval):
+    """ Reload the config file when it changes or when `config_reload` is set. """
+    def _mtime():
+        try:
+            return os.path.getmtime(args.config)
+        except OSError:
+            return None
+
+    mtime = _mtime()
+    while True:
+        config_reload.wait(interval)
+        new_mtime = _mtime()
+        if not config_reload.is_set() and new_mtime == mtime:
+            continue
+
+        config_reload.clear()
+        mtime = new_mtime
+        try:
+            _add_devices_from_config(args)
+            logging.info("Reloaded config file %s", args.config)
+        except Exception as err:  # pylint: disable=broad-except
+            logging.error("Couldn't reload config file %s: %s", args.config, err)
 
 
 def main():
     """ Set up the server. """
     parser = argparse.ArgumentParser(description='AFTV Server')
     parser.add_argument('-p', '--port', type=int, help='listen port', default=5556)
+    parser.add_argument('--host', type=str, help='listen address', default='0.0.0.0')
     parser.add_argument('-d', '--default', help='default Amazon Fire TV host', nargs='?')
     parser.add_argument('-c', '--config', type=str, help='Path to config file')
+    parser.add_argument('--watch-config', type=float, help='seconds between checks of the config file for changes', nargs='?', const=5.)
+    parser.add_argument('--poll', action='store_true', help='poll devices in the background')
+    parser.add_argument('--poll-concurrency', type=int, help='maximum number of devices polled at the same time', default=4)
+    parser.add_argument('-w', '--webhook', action='append', help='URL to POST state changes to (implies --poll); may be repeated')
+    parser.add_argument('--state-file', type=str, help='Path to a memory-mapped file to publish polled states to (implies --poll)')
+    parser.add_argument('--state-file-slots', type=int, help='maximum number of devices in the state file', default=1024)
+    parser.add_argument('-s', '--snapshot', type=str, help='Path to a state snapshot file for warm restarts')
+    parser.add_argument('--snapshot-interval', type=float, help='seconds between snapshot writes', default=5.)
+    parser.add_argument('--shards', type=int, help='number of worker processes to distribute devices across')
+    parser.add_argument('--shard-port', type=int, help='local port of the first worker process', default=15556)
     args = parser.parse_args()
 
-    if args.config:
-        _add_devices_from_config(args)
+    if args.poll_concurrency < 1:
+        exit('invalid poll concurrency')
+
+    if args.shards:
+        _run_sharded(args)
+        return
+
+    global scheduler, webhooks, state_file
+    webhook_urls = _webhook_urls(args)
+    if webhook_urls:
+        webhooks = WebhookDispatcher(webhook_urls)
+        if not args.poll:
+            # webhook events come from polling
+            logging.info("Polling devices in the background for the webhooks")
+            args.poll = True
+
+    if args.state_file:
+        state_file = StateFileWriter(args.state_file, args.state_file_slots)
+        if not args.poll:
+            # the state file is written from polling
+            logging.info("Polling devices in the background for the state file")
+            args.poll = True
+
+    if args.poll:
+        scheduler = PollScheduler(max_concurrent=args.poll_concurrency)
+        scheduler.subscribe(_on_poll)
+        scheduler.start()
 
     home = expanduser("~")
     adb_key = os.path.join(home, ".android", "adbkey")
@@ -267,10 +1175,85 @@ def main():
     if not os.path.exists(adb_key):
         adb_key = ''
 
-    if args.default and not add('default', args.default, adbkey=adb_key):
+    if args.default and not is_valid_host(args.default):
         exit('invalid hostname')
 
-    app.run(host='0.0.0.0', port=args.port)
+    def _add_devices():
+        if args.config:
+            _add_devices_from_config(args)
+
+        configured = set(config_devices)
+        if args.default:
+            add('default', args.default, adbkey=adb_key, origin=ORIGIN_CONFIG)
+            configured.add('default')
+
+        _add_devices_from_snapshot(configured)
+
+        if args.config:
+            # reload the config file on SIGHUP and, optionally, whenever it changes
+            watch_thread = threading.Thread(target=_watch_config, args=(args, args.watch_config))
+            watch_thread.daemon = True
+            watch_thread.start()
+
+    if args.config and hasattr(signal, 'SIGHUP'):
+        # reload the config file on SIGHUP
+        signal.signal(signal.SIGHUP, lambda signum, frame: config_reload.set())
+
+    if args.snapshot:
+        # serve the last known values while the devices reconnect in the background
+        _load_snapshot(args.snapshot)
+        connect_thread = threading.Thread(target=_add_devices)
+        connect_thread.daemon = True
+        connect_thread.start()
+
+        snapshot_thread = threading.Thread(target=_snapshot_loop, args=(args.snapshot, args.snapshot_interval))
+        snapshot_thread.daemon = True
+        snapshot_thread.start()
+    else:
+        _add_devices()
+
+    app.run(host=args.host, port=args.port)
+
+
+def _webhook_urls(args):
+    """ Get the webhook URLs from the command line and the config file. """
+    webhook_urls = list(args.webhook or [])
+    if args.config:
+        webhook_urls += (_parse_config(args.config) or {}).get('webhooks') or []
+    return webhook_urls
+
+
+def _run_sharded(args):
+    """ Run a front-end that distributes devices across worker processes. """
+    from firetv.shard import ShardedServer
+
+    if args.snapshot or args.watch_config or args.state_file:
+        logging.warning("Snapshots, config reloading and state files are not supported with --shards")
+
+    # each worker polls its own devices and delivers their webhook events
+    worker_args = ['--poll-concurrency', str(args.poll_concurrency)]
+    if args.poll:
+        worker_args.append('--poll')
+    for url in _webhook_urls(args):
+        worker_args += ['-w', url]
+
+    server = ShardedServer(args.shards, args.shard_port, worker_args)
+    server.start()
+
+    if args.config:
+        for device_id, device_args in _devices_from_config(args).items():
+            server.add(device_id, **device_args)
+
+    if args.default:
+        home = expanduser("~")
+        adb_key = os.path.join(home, ".android", "adbkey")
+        if not os.path.exists(adb_key):
+            adb_key = ''
+        if not is_valid_host(args.default) or not server.add('default', args.default, adbkey=adb_key):
+            server.stop()
+            exit('invalid hostname')
+
+    server.run(host=args.host, port=args.port)
 
 
 if __name__ == '__main__':
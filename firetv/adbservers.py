@@ -0,0 +1,140 @@
+"""
+Load balancing and failover across ADB servers for the pure-python-adb transport.
+
+A device can be reached through any of several ADB servers.  Servers are
+shared by all `FireTV` objects in the process, so the load of each server
+(the devices assigned to it and the commands in flight) is known across the
+fleet.  A device is assigned to the least-loaded healthy server, and a server
+that fails is avoided for ``FAILURE_BACKOFF`` seconds while its devices move
+to the others.
+"""
+
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+
+# How long (in seconds) a server that failed is avoided
+FAILURE_BACKOFF = 10.
+
+
+class AdbServer(object):
+    """An ADB server and its load."""
+
+    def __init__(self, host, port):
+        """Initialize AdbServer object.
+
+        :param host: The IP address of the ADB server.
+        :param port: The port of the ADB server.
+        """
+        self.host = host
+        self.port = port
+
+        # the number of devices assigned to the server and of commands in flight
+        self.devices = 0
+        self.in_flight = 0
+
+        # when the server last failed, or `None`
+        self.failed_at = None
+
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'AdbServer({0!r}, {1!r})'.format(self.host, self.port)
+
+    @property
+    def healthy(self):
+        """Whether the server has not failed recently."""
+        return self.failed_at is None or time.time() - self.failed_at >= FAILURE_BACKOFF
+
+    def client(self):
+        """Get the pure-python-adb client for the server."""
+        if self._client is None:
+            from adb_messenger.client import Client as AdbClient
+            self._client = AdbClient(host=self.host, port=self.port)
+        return self._client
+
+    def mark_failed(self, err=None):
+        """Avoid the server for ``FAILURE_BACKOFF`` seconds.
+
+        :param err: The error that the server failed with.
+        """
+        if self.healthy:
+            logging.warning("ADB server %s:%d failed: %s", self.host, self.port, err)
+        self.failed_at = time.time()
+        self._client = None
+
+    def mark_ok(self):
+        """Record that the server answered."""
+        self.failed_at = None
+
+    def assign(self, delta):
+        """Change the number of devices assigned to the server."""
+        with self._lock:
+            self.devices += delta
+
+    @contextmanager
+    def busy(self):
+        """Count a command as in flight while the context is active."""
+        with self._lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+# (host, port) -> AdbServer
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def get_server(host, port):
+    """Get the shared `AdbServer` for an address."""
+    with _servers_lock:
+        server = _servers.get((host, port))
+        if server is None:
+            server = _servers[(host, port)] = AdbServer(host, port)
+        return server
+
+
+def parse_servers(adb_server_ip, adb_server_port=5037):
+    """Parse a list of ADB server addresses.
+
+    :param adb_server_ip: An IP address, a comma-separated string of ``<address>[:<port>]``
+                          entries, or a list of them.
+    :param adb_server_port: The port of the entries that don't specify one.
+    :returns: A list of ``(host, port)`` tuples.
+    """
+    if isinstance(adb_server_ip, (list, tuple)):
+        entries = adb_server_ip
+    else:
+        entries = str(adb_server_ip).split(',')
+
+    servers = []
+    for entry in entries:
+        host, _, port = str(entry).strip().partition(':')
+        if host:
+            servers.append((host, int(port) if port else int(adb_server_port)))
+    return servers
+
+
+def choose_server(servers, exclude=()):
+    """Choose the least-loaded healthy server.
+
+    :param servers: The candidate `AdbServer` objects.
+    :param exclude: Servers that must not be chosen.
+    :returns: The chosen server, the one that failed longest ago if none are healthy,
+              or ``None`` if all are excluded.
+    """
+    candidates = [server for server in servers if server not in exclude]
+    if not candidates:
+        return None
+
+    healthy = [server for server in candidates if server.healthy]
+    if healthy:
+        return min(healthy, key=lambda server: (server.devices + server.in_flight, server.in_flight))
+    return min(candidates, key=lambda server: server.failed_at)
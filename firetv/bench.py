@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""
+Compare the ADB transports against an Amazon Fire TV device.
+
+For each installed transport, measures the time to connect, the latency of a
+trivial shell command, and the throughput of a binary transfer.
+"""
+
+import argparse
+import time
+
+from firetv import FireTV, TRANSPORT_PURE_PYTHON_ADB, TRANSPORTS, transport_available
+
+
+# A trivial shell command for measuring latency
+LATENCY_CMD = "echo 1"
+
+# An `exec-out` command that outputs `count` blocks of 64 KiB
+THROUGHPUT_CMD = "dd if=/dev/zero bs=65536 count={0} 2>/dev/null"
+
+
+def _percentile(values, percentile):
+    """Get a percentile of a non-empty list of values."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile))]
+
+
+def benchmark(transport, host, adbkey='', adb_server_ip='', adb_server_port=5037, iterations=20, blocks=16):
+    """Benchmark one transport.
+
+    :param transport: One of ``TRANSPORTS``.
+    :param host: Host in format <address>:port.
+    :param adbkey: The path to the "adbkey" file
+    :param adb_server_ip: the IP address for the ADB server
+    :param adb_server_port: the port for the ADB server
+    :param iterations: The number of latency measurements.
+    :param blocks: The number of 64 KiB blocks to transfer when measuring throughput.
+    :returns: A dictionary of results, or ``None`` if the device couldn't be reached.
+    """
+    ftv = FireTV(host, adbkey, adb_server_ip, adb_server_port, transport=transport)
+    if not ftv.available:
+        return None
+
+    try:
+        # the first connection also probes the status commands, so time a reconnect
+        ftv.close()
+        start = time.time()
+        ftv.connect()
+        connect_time = time.time() - start
+        if not ftv.available:
+            return None
+
+        latencies = []
+        for _ in range(iterations):
+            start = time.time()
+            ftv.adb_shell(LATENCY_CMD)
+            latencies.append(time.time() - start)
+
+        start = time.time()
+        size = sum(len(chunk) for chunk in ftv.adb_exec_out(THROUGHPUT_CMD.format(blocks)))
+        elapsed = time.time() - start
+
+        return {'connect': connect_time,
+                'latency_p50': _percentile(latencies, 0.5),
+                'latency_p95': _percentile(latencies, 0.95),
+                'throughput': size / elapsed if elapsed else None}
+    finally:
+        ftv.close()
+
+
+def main():
+    """ Run the benchmark. """
+    parser = argparse.ArgumentParser(description='Compare ADB transports against an Amazon Fire TV device')
+    parser.add_argument('host', help='Amazon Fire TV host in <address>:<port> format')
+    parser.add_argument('-k', '--adbkey', help='Path to the adbkey file', default='')
+    parser.add_argument('--adb-server-ip', help='ADB server IP address (required for pure-python-adb)', default='')
+    parser.add_argument('--adb-server-port', type=int, help='ADB server port', default=5037)
+    parser.add_argument('-t', '--transport', action='append', choices=TRANSPORTS, help='transport to benchmark (default: all installed)')
+    parser.add_argument('-n', '--iterations', type=int, help='number of latency measurements', default=20)
+    parser.add_argument('-b', '--blocks', type=int, help='number of 64 KiB blocks for the throughput measurement', default=16)
+    args = parser.parse_args()
+
+    print('{0:<16} {1:>12} {2:>12} {3:>12} {4:>14}'.format('transport', 'connect (ms)', 'p50 (ms)', 'p95 (ms)', 'throughput'))
+    for transport in args.transport or TRANSPORTS:
+        if not transport_available(transport):
+            print('{0:<16} not installed'.format(transport))
+            continue
+        if transport == TRANSPORT_PURE_PYTHON_ADB and not args.adb_server_ip:
+            print('{0:<16} skipped (requires --adb-server-ip)'.format(transport))
+            continue
+
+        result = benchmark(transport, args.host, args.adbkey, args.adb_server_ip, args.adb_server_port, args.iterations, args.blocks)
+        if result is None:
+            print('{0:<16} could not connect'.format(transport))
+            continue
+
+        throughput = '{0:.0f} KiB/s'.format(result['throughput'] / 1024) if result['throughput'] else '-'
+        print('{0:<16} {1:>12.1f} {2:>12.1f} {3:>12.1f} {4:>14}'.format(transport, result['connect'] * 1000, result['latency_p50'] * 1000,
+                                                                         result['latency_p95'] * 1000, throughput))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""
+Discover Amazon Fire TV devices on the local network.
+
+Every address in a CIDR range is probed concurrently for an open ADB port.
+Devices that answer are identified from the banner in their reply to an ADB
+``CNXN`` message, which includes ``ro.product.model`` (Fire TV models start
+with "AFT").  Devices that require authentication (``ro.adb.secure=1``, as
+Fire TVs normally do) reply with ``AUTH`` instead; they can't be identified
+without a key they already trust, so they are reported as candidates with
+``"firetv": None``.
+"""
+
+import logging
+import socket
+import struct
+import threading
+
+
+# The default ADB port
+ADB_PORT = 5555
+
+# Fire TV model names (`ro.product.model`) start with this prefix
+FIRETV_MODEL_PREFIX = 'AFT'
+
+# How long (in seconds) to wait for each device to connect and reply
+PROBE_TIMEOUT = 1.
+
+# The default number of addresses probed at the same time
+MAX_WORKERS = 128
+
+# The shortest prefix length (i.e. the largest range) that `discover` scans by default
+MIN_PREFIX = 20
+
+# ADB protocol constants
+A_CNXN = b'CNXN'
+A_AUTH = b'AUTH'
+A_VERSION = 0x01000000
+MAX_ADB_DATA = 4096
+CNXN_PAYLOAD = b'host::\x00'
+
+
+def _message(command, arg0, arg1, data):
+    """Pack an ADB message."""
+    command_id = struct.unpack('<I', command)[0]
+    checksum = sum(bytearray(data)) & 0xFFFFFFFF
+    return struct.pack('<6I', command_id, arg0, arg1, len(data), checksum, command_id ^ 0xFFFFFFFF) + data
+
+
+def _recv_exactly(sock, length):
+    """Receive exactly ``length`` bytes from a socket."""
+    data = b''
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise IOError("Connection closed")
+        data += chunk
+    return data
+
+
+def parse_banner(banner):
+    """Parse the properties in an ADB ``CNXN`` banner.
+
+    :param banner: A banner such as "device::ro.product.name=...;ro.product.model=...;"
+    :returns: A dictionary of the properties.
+    """
+    _, _, props = banner.partition('::')
+    properties = {}
+    for prop in props.split(';'):
+        key, sep, value = prop.partition('=')
+        if sep:
+            properties[key] = value
+    return properties
+
+
+def probe(address, port=ADB_PORT, timeout=PROBE_TIMEOUT):
+    """Check whether an address runs ADB and identify the device.
+
+    :param address: The IP address.
+    :param port: The ADB port.
+    :param timeout: How long (in seconds) to wait for the connection and the reply.
+    :returns: A dictionary describing the device, or ``None`` if ADB is not available at the address.
+              ``firetv`` is ``None`` if the device requires authentication and so could not be identified.
+    """
+    try:
+        sock = socket.create_connection((address, port), timeout)
+    except (socket.error, socket.timeout):
+        return None
+
+    try:
+        sock.settimeout(timeout)
+        sock.sendall(_message(A_CNXN, A_VERSION, MAX_ADB_DATA, CNXN_PAYLOAD))
+        command, _, _, length, _, _ = struct.unpack('<4s5I', _recv_exactly(sock, 24))
+        data = _recv_exactly(sock, length) if command == A_CNXN else b''
+    except (socket.error, socket.timeout, IOError, struct.error):
+        return None
+    finally:
+        sock.close()
+
+    if command not in (A_CNXN, A_AUTH):
+        return None
+
+    properties = parse_banner(data.rstrip(b'\x00').decode('utf8', 'replace'))
+    model = properties.get('ro.product.model')
+    return {'host': '{0}:{1}'.format(address, port),
+            'authorized': command == A_CNXN,
+            'model': model,
+            'name': properties.get('ro.product.name'),
+            'firetv': bool(model and model.startswith(FIRETV_MODEL_PREFIX)) if command == A_CNXN else None}
+
+
+def _parse_cidr(cidr):
+    """Parse a CIDR range.
+
+    :param cidr: The range, e.g. "192.168.0.0/24".
+    :returns: A ``(prefix, first, end)`` tuple with the prefix length and the first and
+              one-past-the-last host addresses as integers.
+    """
+    address, _, prefix = cidr.partition('/')
+    prefix = int(prefix) if prefix else 32
+    if not 0 <= prefix <= 32:
+        raise ValueError("Invalid CIDR range: {0}".format(cidr))
+
+    start = struct.unpack('!I', socket.inet_aton(address))[0] & ((0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF)
+    size = 1 << (32 - prefix)
+    if size > 2:
+        return prefix, start + 1, start + size - 1
+    return prefix, start, start + size
+
+
+def _addresses(first, end):
+    """Generate the IP addresses from ``first`` up to (but excluding) ``end``."""
+    value = first
+    while value < end:
+        yield socket.inet_ntoa(struct.pack('!I', value))
+        value += 1
+
+
+def hosts(cidr):
+    """Get the host addresses in a CIDR range.
+
+    The range is checked immediately, but the addresses are generated as they
+    are consumed, so large ranges don't use memory up front.
+
+    :param cidr: The range, e.g. "192.168.0.0/24".
+    :returns: An iterator of IP addresses (excluding the network and broadcast addresses for ranges larger than /31).
+    """
+    _, first, end = _parse_cidr(cidr)
+    return _addresses(first, end)
+
+
+def discover(cidr, port=ADB_PORT, timeout=PROBE_TIMEOUT, max_workers=MAX_WORKERS, firetv_only=True, min_prefix=MIN_PREFIX):
+    """Find ADB devices in a CIDR range.
+
+    :param cidr: The range, e.g. "192.168.0.0/24".
+    :param port: The ADB port.
+    :param timeout: How long (in seconds) to wait for each device.
+    :param max_workers: The number of addresses probed at the same time.
+    :param firetv_only: Whether to exclude devices that are identified as something other than
+                        a Fire TV.  Devices that require authentication cannot be identified
+                        and are always included, with ``"firetv": None``.
+    :param min_prefix: The shortest prefix length allowed; larger ranges raise `ValueError`.
+    :returns: A list of dictionaries describing the devices (see `probe`), sorted by address.
+    """
+    prefix, first, end = _parse_cidr(cidr)
+    if prefix < min_prefix:
+        raise ValueError("CIDR range {0} is larger than /{1}".format(cidr, min_prefix))
+
+    addresses = _addresses(first, end)
+    addresses_lock = threading.Lock()
+
+    found = []
+
+    def _worker():
+        while True:
+            with addresses_lock:
+                address = next(addresses, None)
+            if address is None:
+                return
+            result = probe(address, port, timeout)
+            if result and (result['firetv'] is not False or not firetv_only):
+                logging.debug("Discovered ADB device %s (%s)", result['host'], result['model'])
+                found.append(result)
+
+    threads = [threading.Thread(target=_worker) for _ in range(min(max_workers, end - first))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return sorted(found, key=lambda result: socket.inet_aton(result['host'].split(':')[0]))
@@ -0,0 +1,40 @@
+"""
+Consistent hashing for the sharded firetv-server.
+
+Each node is placed on the ring at ``replicas`` points, and a key belongs to
+the node at the first point after the key's hash, so adding or removing a
+node only moves the keys next to its points.
+"""
+
+import bisect
+import hashlib
+
+
+# The default number of points on the ring per node
+VIRTUAL_NODES = 64
+
+
+class HashRing(object):
+    """A consistent hash ring that maps keys to nodes."""
+
+    def __init__(self, nodes, replicas=VIRTUAL_NODES):
+        """Initialize HashRing object.
+
+        :param nodes: The nodes on the ring.
+        :param replicas: The number of points on the ring per node.
+        """
+        self._ring = sorted((self._hash('{0}-{1}'.format(node, i)), node) for node in nodes for i in range(replicas))
+        self._keys = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key.encode('utf8')).hexdigest()[:16], 16)
+
+    def get(self, key):
+        """Get the node that owns a key.
+
+        :param key: The key.
+        :returns: The node.
+        """
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._ring[index][1]
@@ -0,0 +1,122 @@
+"""
+Compact state history for Amazon Fire TV devices.
+
+Only transitions are stored, so memory use depends on how often a device
+changes state rather than on how often it is polled.  Each transition takes
+7 bytes: a 32-bit timestamp, and the state and current app as small integers
+that index into tables shared by all devices (one for states and one for
+apps, so that the many apps seen across a fleet don't exhaust the 8-bit
+state indexes).
+"""
+
+from array import array
+import threading
+
+
+# The default number of transitions kept per device
+HISTORY_LENGTH = 512
+
+
+class _InternTable(object):
+    """Values interned as small integers, shared by all histories; index 0 is `None`."""
+
+    def __init__(self, max_index):
+        """Initialize _InternTable object.
+
+        :param max_index: The largest index that fits the array that stores them.
+        """
+        self.max_index = max_index
+        self.values = [None]
+        self._indexes = {None: 0}
+        self._lock = threading.Lock()
+
+    def intern(self, value):
+        """Get the small integer that represents a value.
+
+        :param value: The value.
+        :returns: Its index, or 0 (``None``) if the table is full.
+        """
+        index = self._indexes.get(value)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(value)
+                if index is None:
+                    if len(self.values) > self.max_index:
+                        return 0
+                    index = len(self.values)
+                    self.values.append(value)
+                    self._indexes[value] = index
+        return index
+
+
+# Interned states (stored as bytes) and apps (stored as 16-bit integers)
+_state_table = _InternTable(0xFF)
+_app_table = _InternTable(0xFFFF)
+
+
+class StateHistory(object):
+    """A ring buffer of the state and current app transitions of a device."""
+
+    def __init__(self, length=HISTORY_LENGTH):
+        """Initialize StateHistory object.
+
+        :param length: The maximum number of transitions to keep.
+        """
+        self.length = length
+        self._times = array('I', [0] * length)
+        self._states = array('B', [0] * length)
+        self._apps = array('H', [0] * length)
+
+        # the number of transitions recorded so far (the next one goes to `_count % length`)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._count, self.length)
+
+    def record(self, timestamp, state, current_app):
+        """Record the state of the device, if it changed.
+
+        :param timestamp: The time of the observation, in seconds since the epoch.
+        :param state: The device state.
+        :param current_app: The current app.
+        :returns: True if this was a transition, False otherwise
+        """
+        state_index = _state_table.intern(state)
+        app_index = _app_table.intern(current_app)
+
+        with self._lock:
+            if self._count:
+                last = (self._count - 1) % self.length
+                if self._states[last] == state_index and self._apps[last] == app_index:
+                    return False
+
+            position = self._count % self.length
+            self._times[position] = int(timestamp)
+            self._states[position] = state_index
+            self._apps[position] = app_index
+            self._count += 1
+            return True
+
+    def since(self, timestamp=0):
+        """Get the transitions since a point in time.
+
+        The transition that was in effect at ``timestamp`` is included, so that
+        the time spent in each state since ``timestamp`` can be computed.
+
+        :param timestamp: The start time, in seconds since the epoch.
+        :returns: A list of ``(time, state, current_app)`` tuples, oldest first.
+        """
+        with self._lock:
+            count = min(self._count, self.length)
+            start = self._count - count
+            entries = [(self._times[i % self.length], self._states[i % self.length], self._apps[i % self.length])
+                       for i in range(start, self._count)]
+
+        # skip the transitions that were superseded before `timestamp`
+        first = 0
+        for i, (entry_time, _, _) in enumerate(entries):
+            if entry_time <= timestamp:
+                first = i
+
+        return [(entry_time, _state_table.values[state], _app_table.values[app]) for entry_time, state, app in entries[first:]]
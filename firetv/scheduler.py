@@ -0,0 +1,245 @@
+"""
+Adaptive poll scheduler for fleets of Amazon Fire TV devices.
+
+Each device is polled with ``FireTV.update()`` at an interval that depends on
+its last known state: slowly while it is off or unreachable, quickly right
+after a state change, and moderately while it is playing.  Polls are spread
+out with jitter and a fixed pool of worker threads caps the number of ADB
+commands in flight at any one time.
+"""
+
+import heapq
+import logging
+import random
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from firetv import STATE_IDLE, STATE_OFF, STATE_PAUSED, STATE_PLAYING, STATE_STANDBY, STATE_UNKNOWN
+
+
+# Seconds between polls for each state
+DEFAULT_INTERVALS = {STATE_OFF: 60.,
+                     STATE_UNKNOWN: 60.,
+                     STATE_IDLE: 30.,
+                     STATE_STANDBY: 10.,
+                     STATE_PAUSED: 10.,
+                     STATE_PLAYING: 15.}
+
+# Seconds between polls shortly after a state change
+TRANSITION_INTERVAL = 2.
+
+# How long after a state change the device is considered to be transitioning
+TRANSITION_WINDOW = 20.
+
+
+class PollScheduler(object):
+    """Poll many `FireTV` devices at state-dependent intervals."""
+
+    def __init__(self, max_concurrent=4, intervals=None, jitter=0.1, transition_interval=TRANSITION_INTERVAL,
+                 transition_window=TRANSITION_WINDOW, get_running_apps=True):
+        """Initialize PollScheduler object.
+
+        :param max_concurrent: the maximum number of devices polled at the same time
+        :param intervals: a dictionary mapping states to poll intervals (in seconds)
+        :param jitter: the relative amount by which each interval is randomly stretched or shrunk
+        :param transition_interval: the poll interval shortly after a state change
+        :param transition_window: how long (in seconds) after a state change ``transition_interval`` is used
+        :param get_running_apps: whether or not to get the ``running_apps`` property
+        """
+        self.max_concurrent = max_concurrent
+        self.intervals = dict(DEFAULT_INTERVALS)
+        if intervals:
+            self.intervals.update(intervals)
+        self.jitter = jitter
+        self.transition_interval = transition_interval
+        self.transition_window = transition_window
+        self.get_running_apps = get_running_apps
+
+        # the most recent `update()` result for each device
+        self.results = {}
+
+        # device_id -> (FireTV, token); the token invalidates stale heap entries after a remove/add
+        self._devices = {}
+        self._last_change = {}
+        self._token = 0
+
+        # heap of (due time, token, device_id)
+        self._heap = []
+        self._cond = threading.Condition()
+        self._work = queue.Queue()
+        self._subscribers = []
+        self._threads = []
+        self._running = False
+
+    # ======================================================================= #
+    #                                                                         #
+    #                             device methods                              #
+    #                                                                         #
+    # ======================================================================= #
+    def add(self, device_id, ftv):
+        """Start polling a device.
+
+        :param device_id: Device identifier.
+        :param ftv: The `FireTV` instance.
+        """
+        with self._cond:
+            self._token += 1
+            self._devices[device_id] = (ftv, self._token)
+            self._last_change[device_id] = time.time()
+
+            # spread the first polls out so that a whole fleet isn't polled at once
+            due = time.time() + random.uniform(0, self.transition_interval)
+            heapq.heappush(self._heap, (due, self._token, device_id))
+            self._cond.notify()
+
+    def remove(self, device_id):
+        """Stop polling a device.
+
+        :param device_id: Device identifier.
+        """
+        with self._cond:
+            self._devices.pop(device_id, None)
+            self._last_change.pop(device_id, None)
+            self.results.pop(device_id, None)
+
+    def subscribe(self, callback):
+        """Register a function that is called after every poll.
+
+        The callback is called as ``callback(device_id, result, previous)``, where ``result`` and
+        ``previous`` are ``(state, current_app, running_apps)`` tuples (``previous`` may be ``None``).
+
+        :param callback: The function to call.
+        """
+        with self._cond:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Unregister a function registered via `subscribe`.
+
+        :param callback: The function to remove.
+        """
+        with self._cond:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    # ======================================================================= #
+    #                                                                         #
+    #                            scheduling methods                           #
+    #                                                                         #
+    # ======================================================================= #
+    def start(self):
+        """Start the scheduler and worker threads."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+
+        self._threads = [threading.Thread(target=self._schedule_loop, name='firetv-scheduler')]
+        self._threads += [threading.Thread(target=self._work_loop, name='firetv-poll-{}'.format(i)) for i in range(self.max_concurrent)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """Stop the scheduler and wait for in-flight polls to finish."""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify_all()
+
+        for _ in range(self.max_concurrent):
+            self._work.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def interval(self, device_id, state):
+        """Get the number of seconds until a device should next be polled.
+
+        :param device_id: Device identifier.
+        :param state: The device's most recent state.
+        :returns: The poll interval, including jitter.
+        """
+        if time.time() - self._last_change.get(device_id, 0) < self.transition_window:
+            interval = self.transition_interval
+        else:
+            interval = self.intervals.get(state, self.intervals[STATE_UNKNOWN])
+
+        return interval * random.uniform(1. - self.jitter, 1. + self.jitter)
+
+    def _schedule_loop(self):
+        """Hand devices that are due to the worker threads."""
+        with self._cond:
+            while self._running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                due, token, device_id = self._heap[0]
+                now = time.time()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+
+                heapq.heappop(self._heap)
+
+                # skip devices that were removed or re-added since this entry was scheduled
+                if device_id in self._devices and self._devices[device_id][1] == token:
+                    self._work.put((device_id, token))
+
+    def _work_loop(self):
+        """Poll devices handed over by the scheduler thread."""
+        while True:
+            item = self._work.get()
+            if item is None:
+                return
+
+            device_id, token = item
+            with self._cond:
+                if device_id not in self._devices:
+                    continue
+                ftv = self._devices[device_id][0]
+
+            result = self._poll(ftv)
+
+            with self._cond:
+                # the device was removed while it was being polled
+                if device_id not in self._devices or self._devices[device_id][1] != token:
+                    continue
+
+                previous = self.results.get(device_id)
+                self.results[device_id] = result
+                if previous is None or previous[0] != result[0]:
+                    self._last_change[device_id] = time.time()
+
+                heapq.heappush(self._heap, (time.time() + self.interval(device_id, result[0]), token, device_id))
+                self._cond.notify()
+                subscribers = list(self._subscribers)
+
+            for callback in subscribers:
+                try:
+                    callback(device_id, result, previous)
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception("Poll subscriber %r failed for device %s", callback, device_id)
+
+    def _poll(self, ftv):
+        """Get the state of a device, reconnecting if necessary.
+
+        :param ftv: The `FireTV` instance.
+        :returns: The ``(state, current_app, running_apps)`` tuple.
+        """
+        try:
+            if not ftv.available:
+                ftv.connect(always_log_errors=False)
+                if not ftv.available:
+                    return STATE_UNKNOWN, None, None
+            return ftv.update(get_running_apps=self.get_running_apps)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Couldn't poll host: %s", ftv.host)
+            return STATE_UNKNOWN, None, None
@@ -0,0 +1,523 @@
+"""
+Sharded firetv-server
+
+Distributes devices across several firetv-server worker processes by a
+consistent hash of the device identifier, so that parsing, JSON encoding and
+ADB crypto for large fleets are spread over multiple cores.  A thin front-end
+routes each request to the worker that owns the device and merges the results
+of fleet-wide routes.
+"""
+
+import json
+import logging
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+try:
+    from urllib.parse import urlencode
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    from urllib import urlencode
+    from urllib2 import Request, urlopen, HTTPError, URLError
+
+from flask import Flask, Response, jsonify, request
+
+from firetv.discovery import ADB_PORT, discover
+from firetv.hashring import HashRing
+
+# MessagePack is only needed for binary `/devices/status` responses
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# How long (in seconds) to wait for a worker to start accepting requests
+WORKER_START_TIMEOUT = 30.
+
+# How often (in seconds) the workers are checked
+SUPERVISE_INTERVAL = 1.
+
+# After this many failed restarts in a row, a worker's devices move to the other workers
+MAX_RESTART_ATTEMPTS = 3
+
+# How often (in seconds) a worker that was taken off the ring is tried again
+DEAD_SHARD_RETRY_INTERVAL = 60.
+
+# How long (in seconds) to wait for a worker to answer a request
+PROXY_TIMEOUT = 60.
+
+# The maximum number of bytes to read at a time from a worker response
+CHUNK_SIZE = 64 * 1024
+
+# Matches request paths whose responses stream for as long as the client
+# listens, so they are forwarded without a read timeout
+STREAMING_PATH_REGEX = re.compile(r"^devices/[-\w]+/logcat$")
+
+# Matches request paths that refer to a single device
+DEVICE_PATH_REGEX = re.compile(r"^devices/(?:(?:state|action|connect)/)?(?P<device_id>[-\w]+)(?:/|$)")
+
+# Matches valid device identifiers
+VALID_DEVICE_ID_REGEX = re.compile(r"^[-\w]+$")
+
+# Paths under `/devices/` that are not device identifiers
+FLEET_PATHS = ('list', 'status', 'add', 'install', 'discover')
+
+# The content type of MessagePack responses
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+
+class Shard(object):
+    """A firetv-server worker process."""
+
+    def __init__(self, index, port, worker_args):
+        """Initialize Shard object.
+
+        :param index: The shard number.
+        :param port: The local port that the worker listens on.
+        :param worker_args: Extra command line arguments for the worker.
+        """
+        self.index = index
+        self.port = port
+        self.worker_args = worker_args
+        self.url = 'http://127.0.0.1:{0}'.format(port)
+        self._process = None
+
+        # the number of failed starts in a row, and when the worker was last started
+        self.failures = 0
+        self.started_at = 0.
+
+    @property
+    def alive(self):
+        """Check whether the worker process is running."""
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        """Start the worker process and wait until it accepts requests.
+
+        :returns: True if the worker started successfully, False otherwise
+        """
+        cmd = [sys.executable, '-m', 'firetv', '--host', '127.0.0.1', '-p', str(self.port)] + self.worker_args
+        self.started_at = time.time()
+        self._process = subprocess.Popen(cmd)
+
+        deadline = time.time() + WORKER_START_TIMEOUT
+        while time.time() < deadline and self.alive:
+            try:
+                urlopen(self.url + '/devices/list', timeout=1).read()
+                self.failures = 0
+                return True
+            except (URLError, IOError):
+                time.sleep(0.1)
+
+        logging.error("Shard %d did not start", self.index)
+        self.stop()
+        self.failures += 1
+        return False
+
+    @property
+    def in_ring(self):
+        """Whether the worker owns devices, i.e. it has not failed to restart too often."""
+        return self.failures < MAX_RESTART_ATTEMPTS
+
+    def stop(self):
+        """Stop the worker process."""
+        if self.alive:
+            self._process.terminate()
+            self._process.wait()
+
+    def request(self, path, method='GET', body=None, headers=None, timeout=PROXY_TIMEOUT):
+        """Send an HTTP request to the worker.
+
+        :param path: The request path, including the query string.
+        :param method: The HTTP method.
+        :param body: The request body.
+        :param headers: The request headers.
+        :param timeout: How long (in seconds) to wait for the worker, or ``None`` to wait indefinitely.
+        :returns: The response (a file-like object with ``getcode()`` and ``headers``).
+        """
+        req = Request(self.url + path, data=body, headers=headers or {})
+        req.get_method = lambda: method
+        try:
+            return urlopen(req, timeout=timeout)
+        except HTTPError as err:
+            return err
+
+
+class ShardedServer(object):
+    """A front-end that routes firetv-server requests to sharded workers."""
+
+    def __init__(self, shards, base_port, worker_args=None):
+        """Initialize ShardedServer object.
+
+        :param shards: The number of worker processes.
+        :param base_port: The local port of the first worker; the others use the following ports.
+        :param worker_args: Extra command line arguments for the workers.
+        """
+        self.shards = [Shard(i, base_port + i, worker_args or []) for i in range(shards)]
+        self.ring = HashRing(range(shards))
+
+        # device_id -> the arguments that the device was added with
+        self.registry = {}
+        self._registry_lock = threading.Lock()
+
+        self.app = Flask(__name__)
+        self.app.add_url_rule('/', 'proxy', self.proxy, defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'DELETE'])
+        self.app.add_url_rule('/<path:path>', 'proxy', self.proxy, methods=['GET', 'POST', 'PUT', 'DELETE'])
+
+    def owner(self, device_id):
+        """Get the shard that owns a device.
+
+        :param device_id: Device identifier.
+        :returns: The `Shard`.
+        """
+        return self.shards[self.ring.get(device_id)]
+
+    # ======================================================================= #
+    #                                                                         #
+    #                           worker management                             #
+    #                                                                         #
+    # ======================================================================= #
+    def start(self):
+        """Start the workers and the thread that restarts them if they exit."""
+        for shard in self.shards:
+            shard.start()
+        if not all(shard.in_ring for shard in self.shards):
+            self._rebalance()
+
+        supervisor = threading.Thread(target=self._supervise, name='firetv-shard-supervisor')
+        supervisor.daemon = True
+        supervisor.start()
+
+    def stop(self):
+        """Stop the workers."""
+        for shard in self.shards:
+            shard.stop()
+
+    def _supervise(self):
+        """Restart workers that exited and re-add the devices that they owned.
+
+        A worker that fails to restart ``MAX_RESTART_ATTEMPTS`` times in a row
+        (e.g. because its port is taken) is taken off the hash ring and its
+        devices move to the other workers.  It is tried again every
+        ``DEAD_SHARD_RETRY_INTERVAL`` seconds, and gets its devices back once
+        it starts.
+        """
+        while True:
+            time.sleep(SUPERVISE_INTERVAL)
+            for shard in self.shards:
+                if shard.alive:
+                    continue
+                if not shard.in_ring and time.time() - shard.started_at < DEAD_SHARD_RETRY_INTERVAL:
+                    continue
+
+                was_in_ring = shard.in_ring
+                logging.warning("Shard %d exited; restarting it", shard.index)
+                if not shard.start():
+                    if was_in_ring and not shard.in_ring:
+                        logging.error("Shard %d failed to restart %d times; moving its devices to the other shards", shard.index, shard.failures)
+                        self._rebalance()
+                    continue
+
+                if not was_in_ring:
+                    logging.warning("Shard %d is back; moving its devices back to it", shard.index)
+                    self._rebalance()
+                    continue
+
+                with self._registry_lock:
+                    owned = [(device_id, args) for device_id, args in self.registry.items() if self.owner(device_id) is shard]
+                for device_id, args in owned:
+                    self._add_to_shard(shard, device_id, args)
+
+    def _rebalance(self):
+        """Rebuild the hash ring from the workers that are in it, and move the devices whose owner changed."""
+        nodes = [shard.index for shard in self.shards if shard.in_ring]
+        if not nodes:
+            logging.error("No shard is available")
+            return
+
+        with self._registry_lock:
+            old_owners = dict((device_id, self.owner(device_id)) for device_id in self.registry)
+            self.ring = HashRing(nodes)
+            moved = [(device_id, args, old_owners[device_id]) for device_id, args in self.registry.items()
+                     if self.owner(device_id) is not old_owners[device_id]]
+
+        for device_id, args, old_owner in moved:
+            self._add_to_shard(self.owner(device_id), device_id, args)
+            if old_owner.alive:
+                try:
+                    old_owner.request('/devices/' + device_id, 'DELETE').close()
+                except (URLError, IOError) as err:
+                    logging.error("Couldn't remove device %s from shard %d: %s", device_id, old_owner.index, err)
+
+    # ======================================================================= #
+    #                                                                         #
+    #                                devices                                  #
+    #                                                                         #
+    # ======================================================================= #
+    def add(self, device_id, host, adbkey='', adb_server_ip='', adb_server_port=5037, transport=None):
+        """Add a device to the shard that owns it.
+
+        :param device_id: Device identifier.
+        :param host: Host in <address>:<port> format.
+        :param adbkey: The path to the "adbkey" file
+        :param adb_server_ip: the IP address for the ADB server
+        :param adb_server_port: the port for the ADB server
+        :param transport: the ADB transport (see ``firetv.TRANSPORTS``); chosen automatically by default
+        :returns: Added successfully or not.
+        """
+        args = {'host': host, 'adbkey': adbkey, 'adb_server_ip': adb_server_ip, 'adb_server_port': adb_server_port, 'transport': transport}
+        success = self._add_to_shard(self.owner(device_id), device_id, args)
+        if success:
+            with self._registry_lock:
+                self.registry[device_id] = args
+        return success
+
+    @staticmethod
+    def _add_to_shard(shard, device_id, args):
+        """Add a device to a specific shard."""
+        body = dict(args, device_id=device_id)
+        try:
+            response = shard.request('/devices/add', 'POST', json.dumps(body).encode('utf8'), {'Content-Type': 'application/json'})
+            return bool(json.loads(response.read().decode('utf8')).get('success'))
+        except (URLError, IOError, ValueError) as err:
+            logging.error("Couldn't add device %s to shard %d: %s", device_id, shard.index, err)
+            return False
+
+    # ======================================================================= #
+    #                                                                         #
+    #                                 routes                                  #
+    #                                                                         #
+    # ======================================================================= #
+    def proxy(self, path):
+        """Route a request to the shard(s) responsible for it."""
+        if path == 'devices/list':
+            return self._list_devices()
+        if path == 'devices/status':
+            return self._status()
+        if path == 'devices/add' and request.method == 'POST':
+            return self._add_device()
+        if path == 'devices/install' and request.method == 'POST':
+            return self._install()
+        if path == 'devices/discover' and request.method == 'POST':
+            return self._discover()
+
+        matches = DEVICE_PATH_REGEX.match(path)
+        if matches and matches.group('device_id') not in FLEET_PATHS:
+            shard = self.owner(matches.group('device_id'))
+
+            # a removed device must not be re-added when its worker restarts
+            if request.method == 'DELETE' and path.rstrip('/') == 'devices/' + matches.group('device_id'):
+                with self._registry_lock:
+                    self.registry.pop(matches.group('device_id'), None)
+        else:
+            shard = self.shards[0]
+
+        return self._forward(shard, path)
+
+    def _forward(self, shard, path):
+        """Forward the current request to a shard and stream back its response."""
+        query = request.query_string.decode('utf8') if isinstance(request.query_string, bytes) else request.query_string
+        full_path = '/' + path + ('?' + query if query else '')
+        headers = {'Content-Type': request.headers['Content-Type']} if 'Content-Type' in request.headers else {}
+
+        timeout = None if STREAMING_PATH_REGEX.match(path) else PROXY_TIMEOUT
+
+        try:
+            response = shard.request(full_path, request.method, request.get_data() or None, headers, timeout)
+        except (URLError, IOError) as err:
+            logging.error("Shard %d is unavailable: %s", shard.index, err)
+            return Response(status=503)
+
+        # relay whatever has arrived rather than waiting for a full chunk, so
+        # that streamed responses (e.g. logcat) reach the client as they are
+        # written; Python 2 responses have no `read1`, so read them by line
+        read = getattr(response, 'read1', None) or response.readline
+
+        def _stream():
+            try:
+                chunk = read(CHUNK_SIZE)
+                while chunk:
+                    yield chunk
+                    chunk = read(CHUNK_SIZE)
+            finally:
+                response.close()
+
+        return Response(_stream(), status=response.getcode(), content_type=response.headers.get('Content-Type'))
+
+    def _list_devices(self):
+        """Merge the device lists of all shards, which are asked in parallel."""
+        output = {}
+
+        def _list_shard(shard):
+            try:
+                output.update(json.loads(shard.request('/devices/list').read().decode('utf8')).get('devices', {}))
+            except (URLError, IOError, ValueError) as err:
+                logging.error("Couldn't list the devices of shard %d: %s", shard.index, err)
+
+        _in_parallel(_list_shard, [(shard,) for shard in self.shards])
+        return jsonify(devices=output)
+
+    def _status(self):
+        """Merge the statuses of the requested devices from the shards that own them."""
+        use_msgpack = request.args.get('format') == 'msgpack' or request.accept_mimetypes.best == MSGPACK_MIMETYPE
+        if use_msgpack and msgpack is None:
+            return Response(status=406)
+
+        params = dict((key, value) for key, value in request.args.items() if key not in ('format', 'timeout_ms'))
+        if request.args.get('ids'):
+            shards = {}
+            for device_id in request.args['ids'].split(','):
+                shards.setdefault(self.owner(device_id), []).append(device_id)
+        else:
+            shards = dict((shard, None) for shard in self.shards)
+
+        # all shards share one deadline, so the request takes `timeout_ms` at most
+        timeout_ms = request.args.get('timeout_ms', type=float)
+        end = None if timeout_ms is None else time.time() + timeout_ms / 1000.
+
+        output = {}
+        errors = []
+
+        def _status_of_shard(shard, device_ids):
+            shard_params = dict(params)
+            if device_ids is not None:
+                shard_params['ids'] = ','.join(device_ids)
+
+            timeout = PROXY_TIMEOUT
+            if end is not None:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    output.update((device_id, {'timeout': True}) for device_id in device_ids or [])
+                    return
+                shard_params['timeout_ms'] = int(remaining * 1000) or 1
+                # leave the worker time to answer with what it gathered
+                timeout = remaining + 1.
+
+            try:
+                response = shard.request('/devices/status?' + urlencode(shard_params), timeout=timeout)
+                if response.getcode() != 200:
+                    logging.error("Shard %d couldn't get the device statuses: HTTP %d", shard.index, response.getcode())
+                    errors.append(response.getcode())
+                    output.update((device_id, {'error': 'HTTP {0}'.format(response.getcode())}) for device_id in device_ids or [])
+                    return
+                output.update(json.loads(response.read().decode('utf8')).get('devices', {}))
+            except (URLError, IOError, ValueError) as err:
+                logging.error("Couldn't get the device statuses of shard %d: %s", shard.index, err)
+                output.update((device_id, {'error': str(err)}) for device_id in device_ids or [])
+
+        _in_parallel(_status_of_shard, list(shards.items()))
+
+        # a request that every shard rejected (e.g. an unknown field) is an error of its own
+        if errors and len(errors) == len(shards):
+            return Response(status=errors[0])
+
+        if use_msgpack:
+            return Response(msgpack.packb({'devices': output}), mimetype=MSGPACK_MIMETYPE)
+        return jsonify(devices=output)
+
+    def _add_device(self):
+        """Add a device to the shard that owns it."""
+        req = request.get_json()
+        success = False
+        if 'device_id' in req and 'host' in req:
+            success = self.add(req['device_id'], req['host'], req.get('adbkey', ''), req.get('adb_server_ip', ''), req.get('adb_server_port', 5037), req.get('transport'))
+        return jsonify(success=success)
+
+    def _discover(self):
+        """Discover devices and register new ones with the shards that own them."""
+        req = request.get_json()
+        if not req or 'cidr' not in req:
+            return Response(status=400)
+
+        try:
+            found = discover(req['cidr'], port=int(req.get('port', ADB_PORT)), firetv_only=bool(req.get('firetv_only', True)))
+        except (ValueError, IOError):
+            return Response(status=400)
+
+        if req.get('register'):
+            with self._registry_lock:
+                known_hosts = set(args['host'] for args in self.registry.values())
+            for result in found:
+                if result['host'] not in known_hosts:
+                    device_id = 'firetv-' + result['host'].partition(':')[0].replace('.', '-')
+                    result['device_id'] = device_id
+                    result['registered'] = self.add(device_id, result['host'])
+
+        return jsonify(devices=found)
+
+    def _install(self):
+        """Install an uploaded APK, with each shard installing it on the devices it owns."""
+        if 'apk' not in request.files:
+            return Response(status=400)
+
+        with self._registry_lock:
+            device_ids = request.form.getlist('device_id') or list(self.registry.keys())
+        if not all(VALID_DEVICE_ID_REGEX.match(device_id) for device_id in device_ids):
+            return Response(status=403)
+
+        by_shard = {}
+        for device_id in device_ids:
+            by_shard.setdefault(self.owner(device_id).index, []).append(device_id)
+
+        # the workers don't use the uploaded file name, so don't forward it
+        data = request.files['apk'].read()
+        results = {}
+
+        def _install_on_shard(shard, shard_device_ids):
+            body, content_type = _encode_multipart([('device_id', device_id) for device_id in shard_device_ids], 'apk', 'firetv.apk', data)
+            try:
+                response = shard.request('/devices/install', 'POST', body, {'Content-Type': content_type})
+                results.update(json.loads(response.read().decode('utf8')).get('devices', {}))
+            except (URLError, IOError, ValueError) as err:
+                logging.error("Couldn't install on shard %d: %s", shard.index, err)
+                results.update((device_id, False) for device_id in shard_device_ids)
+
+        _in_parallel(_install_on_shard, [(self.shards[index], shard_device_ids) for index, shard_device_ids in by_shard.items()])
+
+        return jsonify(success=all(results.values()), devices=results)
+
+    def run(self, host='0.0.0.0', port=5556):
+        """Serve the front-end until interrupted, then stop the workers."""
+        try:
+            self.app.run(host=host, port=port, threaded=True)
+        finally:
+            self.stop()
+
+
+def _in_parallel(func, calls):
+    """Call a function once per argument tuple, each in its own thread, and wait for all of them.
+
+    :param func: The function.
+    :param calls: A list of argument tuples.
+    """
+    threads = [threading.Thread(target=func, args=args) for args in calls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def _encode_multipart(fields, file_field, filename, data):
+    """Encode form fields and a file as a ``multipart/form-data`` body.
+
+    :param fields: A list of ``(name, value)`` pairs.
+    :param file_field: The name of the file field.
+    :param filename: The file name.
+    :param data: The file contents.
+    :returns: The body and the ``Content-Type`` header.
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields:
+        parts.append('--{0}\r\nContent-Disposition: form-data; name="{1}"\r\n\r\n{2}\r\n'.format(boundary, name, value).encode('utf8'))
+    parts.append('--{0}\r\nContent-Disposition: form-data; name="{1}"; filename="{2}"\r\n'
+                 'Content-Type: application/vnd.android.package-archive\r\n\r\n'.format(boundary, file_field, filename).encode('utf8'))
+    parts.append(data)
+    parts.append('\r\n--{0}--\r\n'.format(boundary).encode('utf8'))
+    return b''.join(parts), 'multipart/form-data; boundary={0}'.format(boundary)
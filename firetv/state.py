@@ -0,0 +1,108 @@
+"""
+Immutable snapshots of the state of an Amazon Fire TV device.
+
+`DeviceState` objects are interned: equal snapshots are the same object, so
+comparing two snapshots is an identity check, and polling a device whose
+state hasn't changed doesn't allocate a new snapshot.
+"""
+
+import json
+import sys
+import threading
+import weakref
+
+if sys.version_info[0] > 2:
+    _intern_string = sys.intern
+else:
+    _intern_string = intern  # noqa: F821  pylint: disable=undefined-variable
+
+
+def _intern(value):
+    """Intern a string (e.g., a package name), leaving ``None`` as is."""
+    return None if value is None else _intern_string(str(value))
+
+
+class DeviceState(object):
+    """The ``state``, ``current_app``, and ``running_apps`` of a device, as returned by `FireTV.update`."""
+
+    __slots__ = ('state', 'current_app', 'running_apps', '__weakref__')
+
+    FIELDS = ('state', 'current_app', 'running_apps')
+
+    # (state, current_app, running_apps) -> DeviceState
+    _instances = weakref.WeakValueDictionary()
+    _instances_lock = threading.Lock()
+
+    def __new__(cls, state, current_app=None, running_apps=None):
+        """Get the snapshot for a state, creating it if necessary.
+
+        :param state: the state of the device
+        :param current_app: the current app
+        :param running_apps: the running apps
+        """
+        key = (_intern(state), _intern(current_app),
+               None if running_apps is None else tuple(_intern(app) for app in running_apps))
+
+        with cls._instances_lock:
+            instance = cls._instances.get(key)
+            if instance is None:
+                instance = super(DeviceState, cls).__new__(cls)
+                object.__setattr__(instance, 'state', key[0])
+                object.__setattr__(instance, 'current_app', key[1])
+                object.__setattr__(instance, 'running_apps', key[2])
+                cls._instances[key] = instance
+        return instance
+
+    @classmethod
+    def from_tuple(cls, result):
+        """Get the snapshot for a ``(state, current_app, running_apps)`` tuple."""
+        return cls(*result)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DeviceState is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("DeviceState is immutable")
+
+    def __reduce__(self):
+        return (DeviceState, self.as_tuple())
+
+    def __eq__(self, other):
+        # snapshots are interned, so equal snapshots are identical
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
+
+    def __hash__(self):
+        return id(self)
+
+    def __repr__(self):
+        return 'DeviceState(state={0!r}, current_app={1!r}, running_apps={2!r})'.format(self.state, self.current_app, self.running_apps)
+
+    def as_tuple(self):
+        """Get the ``(state, current_app, running_apps)`` tuple, with ``running_apps`` as a list."""
+        return self.state, self.current_app, None if self.running_apps is None else list(self.running_apps)
+
+    def as_dict(self):
+        """Get the fields as a dictionary."""
+        return dict(zip(self.FIELDS, self.as_tuple()))
+
+    def to_json(self):
+        """Serialize the snapshot as JSON."""
+        return json.dumps(self.as_dict(), separators=(',', ':'))
+
+    def diff(self, previous):
+        """Get the fields that changed since a previous snapshot.
+
+        :param previous: The previous `DeviceState`, or ``None``.
+        :returns: A dictionary of the changed fields and their new values (empty if nothing changed).
+        """
+        if previous is self:
+            return {}
+
+        current = self.as_dict()
+        if previous is None:
+            return current
+
+        return {field: current[field] for field in self.FIELDS if getattr(self, field) != getattr(previous, field)}
@@ -0,0 +1,273 @@
+"""
+Share the latest device states with local processes through a memory-mapped file.
+
+firetv-server (with ``--poll --state-file <path>``) writes the most recent
+`FireTV.update` result of every device into a fixed slot of the file, and
+`StateFileReader` reads them without any HTTP requests, JSON, or load on the
+server or the devices.
+
+The file starts with a header (``HEADER_FORMAT``), followed by ``slots``
+slots of ``SLOT_SIZE`` bytes.  Each slot starts with a sequence number that
+the writer makes odd before changing the slot and even afterwards (a
+seqlock), so a reader that sees the same even number before and after
+reading the slot knows that it read a consistent snapshot.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from firetv.state import DeviceState
+
+
+# Identifies the file format
+MAGIC = b'FTVS'
+VERSION = 1
+
+# magic, version, number of slots, slot size
+HEADER_FORMAT = '<4sIII'
+HEADER_SIZE = 64
+
+# The size of each slot, and its fixed fields: sequence number, update time,
+# state, device ID, current app, and the length of the running apps (which follow)
+SLOT_SIZE = 1024
+SLOT_FORMAT = '<Id16s64s128sH'
+SLOT_FIXED_SIZE = struct.calcsize(SLOT_FORMAT)
+RUNNING_APPS_SIZE = SLOT_SIZE - SLOT_FIXED_SIZE
+
+# The running apps length that means `None`
+NO_RUNNING_APPS = 0xFFFF
+
+# The default number of slots
+DEFAULT_SLOTS = 1024
+
+# How many times a reader retries a slot that is being written before giving up
+READ_RETRIES = 100
+
+
+def _encode(value, size):
+    """Encode a string for a fixed-size field, or ``None`` as an empty one."""
+    return (value or '').encode('utf8')[:size]
+
+
+def _decode(value):
+    """Decode a fixed-size string field; empty fields are ``None``."""
+    value = value.rstrip(b'\x00')
+    return value.decode('utf8', 'replace') if value else None
+
+
+class StateFileWriter(object):
+    """Publishes device states to a memory-mapped state file."""
+
+    def __init__(self, path, slots=DEFAULT_SLOTS):
+        """Initialize StateFileWriter object.
+
+        The file is created or resized and cleared in place, so that readers
+        that already mapped it keep working.
+
+        :param path: The state file.
+        :param slots: The maximum number of devices.
+        """
+        self.path = path
+        self.slots = slots
+
+        # device_id -> slot index
+        self._indexes = {}
+        self._free = list(range(slots - 1, -1, -1))
+        self._lock = threading.Lock()
+        self._full_logged = False
+
+        size = HEADER_SIZE + slots * SLOT_SIZE
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        # clear the slots left by a previous server
+        self._mmap[:] = b'\x00' * size
+        struct.pack_into(HEADER_FORMAT, self._mmap, 0, MAGIC, VERSION, slots, SLOT_SIZE)
+
+    def _write(self, index, updated, state, device_id, current_app, running_apps):
+        """Write a slot under its seqlock; the caller must hold the lock."""
+        offset = HEADER_SIZE + index * SLOT_SIZE
+        seq = struct.unpack_from('<I', self._mmap, offset)[0]
+
+        # odd: the slot is being written
+        struct.pack_into('<I', self._mmap, offset, (seq + 1) & 0xFFFFFFFF)
+
+        if running_apps is None:
+            apps, apps_length = b'', NO_RUNNING_APPS
+        else:
+            apps = b''
+            for app in running_apps:
+                encoded = app.encode('utf8')
+                if len(apps) + len(encoded) + 1 > RUNNING_APPS_SIZE:
+                    break
+                apps += (b',' if apps else b'') + encoded
+            apps_length = len(apps)
+
+        struct.pack_into(SLOT_FORMAT, self._mmap, offset, (seq + 1) & 0xFFFFFFFF, updated, _encode(state, 16),
+                         _encode(device_id, 64), _encode(current_app, 128), apps_length)
+        self._mmap[offset + SLOT_FIXED_SIZE:offset + SLOT_FIXED_SIZE + len(apps)] = apps
+
+        # even: the slot is consistent
+        struct.pack_into('<I', self._mmap, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def publish(self, device_id, state, current_app, running_apps, updated=None):
+        """Publish the state of a device.
+
+        :param device_id: Device identifier.
+        :param state: The state of the device.
+        :param current_app: The current app.
+        :param running_apps: The running apps.
+        :param updated: When the state was gathered, in seconds since the epoch (default: now).
+        :returns: True if the state was published, False if all slots are in use
+        """
+        with self._lock:
+            index = self._indexes.get(device_id)
+            if index is None:
+                if not self._free:
+                    if not self._full_logged:
+                        logging.warning("All %d slots of state file %s are in use", self.slots, self.path)
+                        self._full_logged = True
+                    return False
+                index = self._indexes[device_id] = self._free.pop()
+
+            self._write(index, time.time() if updated is None else updated, state, device_id, current_app, running_apps)
+            return True
+
+    def remove(self, device_id):
+        """Clear the slot of a device.
+
+        :param device_id: Device identifier.
+        """
+        with self._lock:
+            index = self._indexes.pop(device_id, None)
+            if index is not None:
+                self._write(index, 0., None, None, None, None)
+                self._free.append(index)
+                self._full_logged = False
+
+    def close(self):
+        """Unmap the file."""
+        self._mmap.close()
+
+
+class StateFileReader(object):
+    """Reads device states from a state file written by `StateFileWriter`."""
+
+    def __init__(self, path):
+        """Initialize StateFileReader object.
+
+        :param path: The state file.
+        """
+        self.path = path
+        self._mmap = None
+        self.slots = 0
+
+        # device_id -> the slot it was last found in
+        self._indexes = {}
+
+        self._open()
+
+    def _open(self):
+        """Map the file and check its header."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+        with open(self.path, 'rb') as state_file:
+            self._mmap = mmap.mmap(state_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, slots, slot_size = struct.unpack_from(HEADER_FORMAT, self._mmap, 0)
+        if magic != MAGIC or version != VERSION or slot_size != SLOT_SIZE:
+            raise ValueError("{0} is not a version {1} state file".format(self.path, VERSION))
+        self.slots = slots
+        self._indexes = {}
+
+    def _check_header(self):
+        """Remap the file if the writer resized it."""
+        slots = struct.unpack_from('<I', self._mmap, 8)[0]
+        if slots != self.slots or len(self._mmap) < HEADER_SIZE + slots * SLOT_SIZE:
+            self._open()
+
+    def read_slot(self, index):
+        """Read a consistent snapshot of a slot.
+
+        :param index: The slot index.
+        :returns: A ``(device_id, updated, DeviceState)`` tuple, or ``None`` if the slot is empty
+                  or is being rewritten too often to be read.
+        """
+        offset = HEADER_SIZE + index * SLOT_SIZE
+        for _ in range(READ_RETRIES):
+            seq = struct.unpack_from('<I', self._mmap, offset)[0]
+            if seq & 1:
+                continue
+
+            _, updated, state, device_id, current_app, apps_length = struct.unpack_from(SLOT_FORMAT, self._mmap, offset)
+            if apps_length not in (0, NO_RUNNING_APPS):
+                apps = self._mmap[offset + SLOT_FIXED_SIZE:offset + SLOT_FIXED_SIZE + apps_length]
+            else:
+                apps = b''
+
+            if struct.unpack_from('<I', self._mmap, offset)[0] != seq:
+                continue
+
+            device_id = _decode(device_id)
+            if device_id is None:
+                return None
+
+            if apps_length == NO_RUNNING_APPS:
+                running_apps = None
+            else:
+                running_apps = apps.decode('utf8', 'replace').split(',') if apps else []
+            return device_id, updated, DeviceState(_decode(state), _decode(current_app), running_apps)
+        return None
+
+    def get(self, device_id):
+        """Get the latest state of a device.
+
+        :param device_id: Device identifier.
+        :returns: A ``(updated, DeviceState)`` tuple, or ``None`` if the device is not in the file.
+        """
+        self._check_header()
+
+        index = self._indexes.get(device_id)
+        if index is not None:
+            entry = self.read_slot(index)
+            if entry and entry[0] == device_id:
+                return entry[1], entry[2]
+
+        # the device moved to another slot, or is new to this reader
+        for index in range(self.slots):
+            entry = self.read_slot(index)
+            if entry and entry[0] == device_id:
+                self._indexes[device_id] = index
+                return entry[1], entry[2]
+        return None
+
+    def snapshot(self):
+        """Get the latest states of all devices.
+
+        :returns: A dictionary of device identifiers to ``(updated, DeviceState)`` tuples.
+        """
+        self._check_header()
+
+        states = {}
+        for index in range(self.slots):
+            entry = self.read_slot(index)
+            if entry:
+                self._indexes[entry[0]] = index
+                states[entry[0]] = (entry[1], entry[2])
+        return states
+
+    def close(self):
+        """Unmap the file."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
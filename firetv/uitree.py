@@ -0,0 +1,145 @@
+"""
+The UI hierarchy of an Amazon Fire TV device.
+
+`parse_ui_tree` consumes the XML written by ``uiautomator dump`` as it
+arrives, keeping only the attributes needed for navigation in a flat list of
+nodes rather than building a DOM.  `UiTree` indexes the nodes by text and
+focus, so repeated lookups don't scan the whole list.
+"""
+
+import collections
+import re
+from xml.parsers import expat
+
+
+# The attributes kept for each node
+UiNode = collections.namedtuple('UiNode', ['index', 'parent', 'depth', 'text', 'content_desc', 'resource_id', 'class_name',
+                                           'package', 'bounds', 'focused', 'focusable', 'clickable', 'selected'])
+
+# Matches the `bounds` attribute, e.g. "[0,0][1920,1080]"
+BOUNDS_REGEX = re.compile(r"\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]")
+
+
+def _parse_bounds(bounds):
+    """Parse a `bounds` attribute into a ``(left, top, right, bottom)`` tuple, or ``None``."""
+    matches = BOUNDS_REGEX.match(bounds or '')
+    if not matches:
+        return None
+    return tuple(int(value) for value in matches.groups())
+
+
+class UiTree(object):
+    """The nodes of a UI hierarchy dump, indexed for lookups."""
+
+    def __init__(self, nodes):
+        """Initialize UiTree object.
+
+        :param nodes: A list of `UiNode` objects in document order.
+        """
+        self.nodes = nodes
+
+        # text or content description -> indexes of the nodes
+        self._text_index = {}
+        for node in nodes:
+            for text in set((node.text, node.content_desc)):
+                if text:
+                    self._text_index.setdefault(text, []).append(node.index)
+
+        self._focused = [node.index for node in nodes if node.focused]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    @property
+    def focused(self):
+        """The most deeply nested focused node, or ``None``."""
+        if not self._focused:
+            return None
+        return max((self.nodes[index] for index in self._focused), key=lambda node: node.depth)
+
+    def children(self, node):
+        """Get the direct children of a node."""
+        return [child for child in self.nodes[node.index + 1:] if child.parent == node.index]
+
+    def find(self, text=None, focused=None, resource_id=None):
+        """Find the nodes that match all of the given criteria.
+
+        :param text: the node's text or content description
+        :param focused: whether the node is focused
+        :param resource_id: the node's resource ID
+        :returns: A list of the matching `UiNode` objects, in document order.
+        """
+        if text is not None:
+            candidates = [self.nodes[index] for index in self._text_index.get(text, [])]
+        elif focused:
+            candidates = [self.nodes[index] for index in self._focused]
+        else:
+            candidates = self.nodes
+
+        return [node for node in candidates
+                if (focused is None or node.focused == focused) and (resource_id is None or node.resource_id == resource_id)]
+
+
+def parse_ui_tree(chunks):
+    """Parse the output of ``uiautomator dump`` as it is read.
+
+    :param chunks: An iterable of the bytes written by ``uiautomator dump /dev/tty``.
+    :returns: A `UiTree`, or ``None`` if the output is not a complete UI hierarchy.
+    """
+    nodes = []
+    stack = []
+    state = {'started': False, 'done': False}
+
+    def _start(name, attrs):
+        if name != 'node':
+            return
+        nodes.append(UiNode(index=len(nodes),
+                            parent=stack[-1] if stack else None,
+                            depth=len(stack),
+                            text=attrs.get('text') or None,
+                            content_desc=attrs.get('content-desc') or None,
+                            resource_id=attrs.get('resource-id') or None,
+                            class_name=attrs.get('class') or None,
+                            package=attrs.get('package') or None,
+                            bounds=_parse_bounds(attrs.get('bounds')),
+                            focused=attrs.get('focused') == 'true',
+                            focusable=attrs.get('focusable') == 'true',
+                            clickable=attrs.get('clickable') == 'true',
+                            selected=attrs.get('selected') == 'true'))
+        stack.append(len(nodes) - 1)
+
+    def _end(name):
+        if name == 'node':
+            stack.pop()
+        elif name == 'hierarchy':
+            state['done'] = True
+
+    parser = expat.ParserCreate('utf-8')
+    parser.StartElementHandler = _start
+    parser.EndElementHandler = _end
+
+    # read the whole output, so that the stream is closed cleanly, but stop
+    # parsing at the end of the document (`uiautomator` follows it with a status line)
+    for chunk in chunks:
+        if state['done']:
+            continue
+
+        if not state['started']:
+            start = chunk.find(b'<')
+            if start == -1:
+                continue
+            chunk = chunk[start:]
+            state['started'] = True
+
+        try:
+            parser.Parse(chunk, False)
+        except expat.ExpatError:
+            if not state['done']:
+                return None
+
+    if not state['done']:
+        return None
+    return UiTree(nodes)
@@ -0,0 +1,121 @@
+"""
+Batched webhook delivery for firetv-server.
+
+Each endpoint has its own bounded queue and delivery thread, so publishing an
+event never blocks the caller.  Events that arrive within a short window are
+sent together in one POST, failed deliveries are retried with exponential
+backoff, and when an endpoint falls behind its oldest queued events are
+dropped.
+"""
+
+import collections
+import json
+import logging
+import threading
+import time
+
+try:
+    from urllib.request import Request, urlopen
+except ImportError:
+    from urllib2 import Request, urlopen
+
+
+# How long (in seconds) to wait for more events before sending a batch
+BATCH_WINDOW = 0.5
+
+# The maximum number of events in one batch
+MAX_BATCH_SIZE = 100
+
+# The maximum number of events queued per endpoint; older events are dropped
+MAX_QUEUE_SIZE = 1000
+
+# How long (in seconds) to wait for an endpoint to respond
+DELIVERY_TIMEOUT = 5.
+
+# The number of delivery attempts per batch and the delay (in seconds) before the first retry
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 1.
+
+
+class WebhookEndpoint(object):
+    """A webhook URL with its own queue and delivery thread."""
+
+    def __init__(self, url, batch_window=BATCH_WINDOW, max_queue_size=MAX_QUEUE_SIZE):
+        """Initialize WebhookEndpoint object.
+
+        :param url: The URL that batches of events are POSTed to.
+        :param batch_window: How long (in seconds) to wait for more events before sending a batch.
+        :param max_queue_size: The maximum number of queued events.
+        """
+        self.url = url
+        self.batch_window = batch_window
+        self.dropped = 0
+        self._queue = collections.deque(maxlen=max_queue_size)
+        self._cond = threading.Condition()
+
+        thread = threading.Thread(target=self._deliver_loop, name='firetv-webhook')
+        thread.daemon = True
+        thread.start()
+
+    def publish(self, event):
+        """Queue an event without blocking.
+
+        :param event: A JSON-serializable event.
+        """
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+                if self.dropped == 1 or self.dropped % 100 == 0:
+                    logging.warning("Webhook %s is falling behind; %d events dropped", self.url, self.dropped)
+            self._queue.append(event)
+            self._cond.notify()
+
+    def _next_batch(self):
+        """Wait for events and collect the ones that arrive within the batch window."""
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+
+            deadline = time.time() + self.batch_window
+            while len(self._queue) < MAX_BATCH_SIZE and time.time() < deadline:
+                self._cond.wait(deadline - time.time())
+
+            return [self._queue.popleft() for _ in range(min(len(self._queue), MAX_BATCH_SIZE))]
+
+    def _deliver_loop(self):
+        """Send batches of events, retrying failed deliveries with backoff."""
+        while True:
+            batch = self._next_batch()
+            body = json.dumps({'events': batch}).encode('utf8')
+
+            delay = RETRY_DELAY
+            for attempt in range(MAX_ATTEMPTS):
+                try:
+                    urlopen(Request(self.url, data=body, headers={'Content-Type': 'application/json'}), timeout=DELIVERY_TIMEOUT).close()
+                    break
+                except Exception as err:  # pylint: disable=broad-except
+                    if attempt == MAX_ATTEMPTS - 1:
+                        logging.error("Couldn't deliver %d events to webhook %s: %s", len(batch), self.url, err)
+                    else:
+                        time.sleep(delay)
+                        delay *= 2
+
+
+class WebhookDispatcher(object):
+    """Publishes events to any number of webhook endpoints."""
+
+    def __init__(self, urls=(), batch_window=BATCH_WINDOW):
+        """Initialize WebhookDispatcher object.
+
+        :param urls: The webhook URLs.
+        :param batch_window: How long (in seconds) to wait for more events before sending a batch.
+        """
+        self.endpoints = [WebhookEndpoint(url, batch_window) for url in urls]
+
+    def publish(self, event):
+        """Queue an event for every endpoint without blocking.
+
+        :param event: A JSON-serializable event.
+        """
+        for endpoint in self.endpoints:
+            endpoint.publish(event)
@@ -11,11 +11,14 @@ setup(
     packages=['firetv'],
     install_requires=['pycryptodome', 'rsa', 'adb-homeassistant', 'pure-python-adb-homeassistant'],
     extras_require={
-        'firetv-server': ['Flask>=0.10.1', 'PyYAML>=3.12']
+        'firetv-server': ['Flask>=0.10.1', 'PyYAML>=3.12'],
+        'screenshot': ['Pillow'],
+        'msgpack': ['msgpack']
     },
     entry_points={
         'console_scripts': [
-            'firetv-server = firetv.__main__:main'
+            'firetv-server = firetv.__main__:main',
+            'firetv-bench = firetv.bench:main'
         ]
     },
     classifiers=[
@@ -0,0 +1,42 @@
+import subprocess
+import unittest
+
+from firetv import FireTV
+
+
+def _firetv(run):
+    """Make a `FireTV` object whose shell commands run in `run` instead of on a device."""
+    firetv = FireTV.__new__(FireTV)
+    firetv.adb_shell = run
+    return firetv
+
+
+def _sh(cmd):
+    return subprocess.check_output(['sh', '-c', cmd]).decode('utf8')
+
+
+class TestAdbShellMany(unittest.TestCase):
+
+    def test_framing(self):
+        results = _firetv(_sh).adb_shell_many(['echo one; echo two', 'true', 'printf partial; exit 3', 'echo last'])
+        self.assertEqual(results[0], {'retcode': 0, 'output': 'one\ntwo\n'})
+        self.assertEqual(results[1], {'retcode': 0, 'output': ''})
+        self.assertEqual(results[2], {'retcode': 3, 'output': 'partial'})
+        self.assertEqual(results[3], {'retcode': 0, 'output': 'last\n'})
+
+    def test_stop_on_failure(self):
+        results = _firetv(_sh).adb_shell_many(['echo ok', 'false', 'echo skipped'], stop_on_failure=True)
+        self.assertEqual(results[0], {'retcode': 0, 'output': 'ok\n'})
+        self.assertEqual(results[1]['retcode'], 1)
+        self.assertIsNone(results[2])
+
+    def test_crlf_output(self):
+        results = _firetv(lambda cmd: _sh(cmd).replace('\n', '\r\n')).adb_shell_many(['echo a', 'echo b'])
+        self.assertEqual([result['output'] for result in results], ['a\n', 'b\n'])
+
+    def test_unsuccessful(self):
+        self.assertIsNone(_firetv(lambda cmd: None).adb_shell_many(['echo a']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from firetv import adbservers
+from firetv.adbservers import AdbServer, choose_server, parse_servers
+
+
+class TestParseServers(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_servers('127.0.0.1'), [('127.0.0.1', 5037)])
+        self.assertEqual(parse_servers('10.0.0.1:5038, 10.0.0.2', 5039), [('10.0.0.1', 5038), ('10.0.0.2', 5039)])
+        self.assertEqual(parse_servers(['10.0.0.1', '10.0.0.2:5040']), [('10.0.0.1', 5037), ('10.0.0.2', 5040)])
+        self.assertEqual(parse_servers(''), [])
+
+
+class TestChooseServer(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = [AdbServer('10.0.0.1', 5037), AdbServer('10.0.0.2', 5037)]
+
+    def test_least_loaded(self):
+        self.servers[0].assign(2)
+        self.servers[1].assign(1)
+        self.assertIs(choose_server(self.servers), self.servers[1])
+        with self.servers[1].busy():
+            with self.servers[1].busy():
+                self.assertIs(choose_server(self.servers), self.servers[0])
+        self.assertIs(choose_server(self.servers), self.servers[1])
+
+    def test_failed_server_is_avoided(self):
+        self.servers[0].mark_failed('refused')
+        self.assertIs(choose_server(self.servers), self.servers[1])
+        self.servers[0].mark_ok()
+        self.assertIs(choose_server(self.servers, exclude=[self.servers[1]]), self.servers[0])
+
+    def test_failed_server_recovers_after_backoff(self):
+        self.servers[0].mark_failed('refused')
+        self.servers[0].failed_at -= adbservers.FAILURE_BACKOFF
+        self.assertTrue(self.servers[0].healthy)
+
+    def test_all_failed_or_excluded(self):
+        self.servers[0].mark_failed('refused')
+        self.servers[1].mark_failed('refused')
+        self.servers[1].failed_at += 1
+        self.assertIs(choose_server(self.servers), self.servers[0])
+        self.assertIsNone(choose_server(self.servers, exclude=self.servers))
+
+
+if __name__ == '__main__':
+    unittest.main()
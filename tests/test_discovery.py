@@ -0,0 +1,133 @@
+import socket
+import struct
+import threading
+import unittest
+
+from firetv import discovery
+
+
+class FakeADBServer(object):
+    """Answer every connection with one ADB message."""
+
+    def __init__(self, command, banner=b''):
+        self.reply = discovery._message(command, 0, 0, banner)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            try:
+                discovery._recv_exactly(conn, 24)
+                conn.sendall(self.reply)
+            except (socket.error, IOError):
+                pass
+            finally:
+                conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+class TestParsing(unittest.TestCase):
+
+    def test_parse_banner(self):
+        banner = 'device::ro.product.name=full_mantis;ro.product.model=AFTMM;ro.product.device=mantis;features=cmd,shell_v2'
+        self.assertEqual(discovery.parse_banner(banner), {'ro.product.name': 'full_mantis',
+                                                          'ro.product.model': 'AFTMM',
+                                                          'ro.product.device': 'mantis',
+                                                          'features': 'cmd,shell_v2'})
+
+    def test_parse_banner_without_properties(self):
+        self.assertEqual(discovery.parse_banner(''), {})
+        self.assertEqual(discovery.parse_banner('device::'), {})
+        self.assertEqual(discovery.parse_banner('device::junk;a=1=2;'), {'a': '1=2'})
+
+    def test_parse_cidr(self):
+        base = struct.unpack('!I', socket.inet_aton('192.168.1.0'))[0]
+        self.assertEqual(discovery._parse_cidr('192.168.1.77/24'), (24, base + 1, base + 255))
+        self.assertEqual(discovery._parse_cidr('192.168.1.4/31'), (31, base + 4, base + 6))
+        self.assertEqual(discovery._parse_cidr('192.168.1.4/32'), (32, base + 4, base + 5))
+        self.assertEqual(discovery._parse_cidr('192.168.1.4'), (32, base + 4, base + 5))
+
+    def test_parse_cidr_invalid(self):
+        for cidr in ('192.168.1.0/33', '192.168.1.0/-1', '192.168.1.0/x', 'not.an.address/24'):
+            with self.assertRaises((ValueError, socket.error)):
+                discovery._parse_cidr(cidr)
+
+    def test_hosts(self):
+        self.assertEqual(list(discovery.hosts('10.0.0.0/30')), ['10.0.0.1', '10.0.0.2'])
+        self.assertEqual(list(discovery.hosts('10.0.0.0/31')), ['10.0.0.0', '10.0.0.1'])
+        self.assertEqual(list(discovery.hosts('10.0.0.7/32')), ['10.0.0.7'])
+
+    def test_hosts_is_lazy(self):
+        addresses = discovery.hosts('0.0.0.0/0')
+        self.assertEqual(next(addresses), '0.0.0.1')
+        self.assertEqual(next(addresses), '0.0.0.2')
+
+    def test_discover_rejects_large_ranges(self):
+        with self.assertRaises(ValueError):
+            discovery.discover('10.0.0.0/19')
+        with self.assertRaises(ValueError):
+            discovery.discover('10.0.0.0/8', min_prefix=16)
+
+
+class TestProbe(unittest.TestCase):
+
+    def test_probe_firetv(self):
+        server = FakeADBServer(discovery.A_CNXN, b'device::ro.product.name=full_mantis;ro.product.model=AFTMM;\x00')
+        try:
+            result = discovery.probe('127.0.0.1', server.port)
+        finally:
+            server.close()
+        self.assertEqual(result, {'host': '127.0.0.1:{0}'.format(server.port), 'authorized': True,
+                                  'model': 'AFTMM', 'name': 'full_mantis', 'firetv': True})
+
+    def test_probe_other_device(self):
+        server = FakeADBServer(discovery.A_CNXN, b'device::ro.product.model=Pixel 4;')
+        try:
+            result = discovery.probe('127.0.0.1', server.port)
+        finally:
+            server.close()
+        self.assertIs(result['firetv'], False)
+
+    def test_probe_unauthorized_device(self):
+        server = FakeADBServer(discovery.A_AUTH, b'0' * 20)
+        try:
+            result = discovery.probe('127.0.0.1', server.port)
+        finally:
+            server.close()
+        self.assertFalse(result['authorized'])
+        self.assertIsNone(result['firetv'])
+
+    def test_probe_closed_port(self):
+        server = FakeADBServer(discovery.A_CNXN)
+        server.close()
+        self.assertIsNone(discovery.probe('127.0.0.1', server.port, timeout=0.5))
+
+    def test_discover_keeps_unauthorized_devices(self):
+        server = FakeADBServer(discovery.A_AUTH, b'0' * 20)
+        try:
+            self.assertEqual(len(discovery.discover('127.0.0.1/32', server.port)), 1)
+        finally:
+            server.close()
+
+    def test_discover_firetv_only(self):
+        server = FakeADBServer(discovery.A_CNXN, b'device::ro.product.model=Pixel 4;')
+        try:
+            self.assertEqual(discovery.discover('127.0.0.1/32', server.port), [])
+            self.assertEqual(len(discovery.discover('127.0.0.1/32', server.port, firetv_only=False)), 1)
+        finally:
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
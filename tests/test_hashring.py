@@ -0,0 +1,30 @@
+import unittest
+
+from firetv.hashring import HashRing
+
+
+class TestHashRing(unittest.TestCase):
+
+    def test_same_key_same_node(self):
+        ring = HashRing([0, 1, 2, 3])
+        for i in range(100):
+            key = 'device-{0}'.format(i)
+            self.assertEqual(ring.get(key), ring.get(key))
+            self.assertEqual(ring.get(key), HashRing([0, 1, 2, 3]).get(key))
+
+    def test_keys_are_spread(self):
+        ring = HashRing([0, 1, 2, 3])
+        owners = set(ring.get('device-{0}'.format(i)) for i in range(200))
+        self.assertEqual(owners, set([0, 1, 2, 3]))
+
+    def test_adding_a_node_moves_few_keys(self):
+        keys = ['device-{0}'.format(i) for i in range(1000)]
+        before = HashRing([0, 1, 2, 3])
+        after = HashRing([0, 1, 2, 3, 4])
+        moved = [key for key in keys if before.get(key) != after.get(key)]
+        self.assertTrue(all(after.get(key) == 4 for key in moved))
+        self.assertLess(len(moved), len(keys) / 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from firetv import history
+from firetv.history import StateHistory
+
+
+class TestStateHistory(unittest.TestCase):
+
+    def test_records_only_transitions(self):
+        states = StateHistory(length=8)
+        self.assertTrue(states.record(100, 'idle', 'com.amazon.tv.launcher'))
+        self.assertFalse(states.record(101, 'idle', 'com.amazon.tv.launcher'))
+        self.assertTrue(states.record(102, 'playing', 'com.netflix.ninja'))
+        self.assertEqual(len(states), 2)
+        self.assertEqual(states.since(), [(100, 'idle', 'com.amazon.tv.launcher'),
+                                          (102, 'playing', 'com.netflix.ninja')])
+
+    def test_since_includes_the_transition_in_effect(self):
+        states = StateHistory(length=8)
+        states.record(100, 'idle', None)
+        states.record(200, 'playing', 'com.netflix.ninja')
+        states.record(300, 'paused', 'com.netflix.ninja')
+        self.assertEqual(states.since(250), [(200, 'playing', 'com.netflix.ninja'),
+                                             (300, 'paused', 'com.netflix.ninja')])
+
+    def test_ring_buffer_keeps_the_latest(self):
+        states = StateHistory(length=3)
+        for i in range(5):
+            states.record(i, 'playing', 'app{0}'.format(i))
+        self.assertEqual(len(states), 3)
+        self.assertEqual([app for _, _, app in states.since()], ['app2', 'app3', 'app4'])
+
+    def test_many_apps_do_not_exhaust_state_indexes(self):
+        states = StateHistory(length=4)
+        for i in range(300):
+            states.record(i, 'playing', 'com.example.app{0}'.format(i))
+        states.record(1000, 'idle', 'com.example.app0')
+        self.assertEqual(states.since(1000), [(1000, 'idle', 'com.example.app0')])
+
+    def test_full_table_interns_none(self):
+        table = history._InternTable(2)
+        self.assertEqual(table.intern('a'), 1)
+        self.assertEqual(table.intern('b'), 2)
+        self.assertEqual(table.intern('c'), 0)
+        self.assertEqual(table.intern('a'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
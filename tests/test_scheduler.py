@@ -0,0 +1,100 @@
+import unittest
+
+from firetv import STATE_IDLE, STATE_OFF, STATE_PLAYING, STATE_UNKNOWN
+from firetv import scheduler
+from firetv.scheduler import PollScheduler
+
+
+class FakeFireTV(object):
+
+    def __init__(self, results):
+        self.host = 'fake'
+        self.available = True
+        self.results = list(results)
+
+    def update(self, get_running_apps=True):
+        return self.results.pop(0)
+
+
+class FakeClock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class TestPollScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(1000.)
+        self._time = scheduler.time
+        scheduler.time = self.clock
+
+    def tearDown(self):
+        scheduler.time = self._time
+
+    def test_interval_depends_on_state(self):
+        polls = PollScheduler(jitter=0, transition_window=20)
+        polls.add('tv', FakeFireTV([]))
+        self.clock.now += 30
+        self.assertEqual(polls.interval('tv', STATE_OFF), scheduler.DEFAULT_INTERVALS[STATE_OFF])
+        self.assertEqual(polls.interval('tv', STATE_PLAYING), scheduler.DEFAULT_INTERVALS[STATE_PLAYING])
+
+    def test_interval_overrides_and_unknown_states(self):
+        polls = PollScheduler(intervals={STATE_IDLE: 5.}, jitter=0)
+        self.assertEqual(polls.interval('tv', STATE_IDLE), 5.)
+        self.assertEqual(polls.interval('tv', 'bogus'), scheduler.DEFAULT_INTERVALS[STATE_UNKNOWN])
+
+    def test_interval_during_transition(self):
+        polls = PollScheduler(jitter=0, transition_interval=2, transition_window=20)
+        polls.add('tv', FakeFireTV([]))
+        self.clock.now += 10
+        self.assertEqual(polls.interval('tv', STATE_OFF), 2)
+        self.clock.now += 10
+        self.assertEqual(polls.interval('tv', STATE_OFF), scheduler.DEFAULT_INTERVALS[STATE_OFF])
+
+    def test_interval_jitter(self):
+        polls = PollScheduler(intervals={STATE_IDLE: 10.}, jitter=0.1)
+        for _ in range(100):
+            self.assertTrue(9. <= polls.interval('tv', STATE_IDLE) <= 11.)
+
+    def test_state_change_restarts_transition(self):
+        results = [(STATE_IDLE, 'app', None), (STATE_IDLE, 'app', None), (STATE_PLAYING, 'app', None)]
+        polls = PollScheduler(jitter=0, transition_interval=2, transition_window=20)
+        polls.add('tv', FakeFireTV(results))
+        received = []
+        polls.subscribe(lambda device_id, result, previous: received.append((result, previous)))
+
+        self.clock.now += 100
+        polls._work.put(('tv', polls._devices['tv'][1]))
+        polls._work.put(('tv', polls._devices['tv'][1]))
+        polls._work.put(None)
+        polls._work_loop()
+        # the first result is a change; the second isn't
+        self.assertEqual(polls._last_change['tv'], 1100.)
+        self.clock.now += 50
+        self.assertEqual(polls.interval('tv', STATE_IDLE), scheduler.DEFAULT_INTERVALS[STATE_IDLE])
+
+        polls._work.put(('tv', polls._devices['tv'][1]))
+        polls._work.put(None)
+        polls._work_loop()
+        self.assertEqual(polls._last_change['tv'], 1150.)
+        self.assertEqual(polls.interval('tv', STATE_PLAYING), 2)
+        self.assertEqual(received[-1], ((STATE_PLAYING, 'app', None), (STATE_IDLE, 'app', None)))
+        self.assertEqual(polls.results['tv'], (STATE_PLAYING, 'app', None))
+
+    def test_removed_device_is_not_rescheduled(self):
+        polls = PollScheduler(jitter=0)
+        polls.add('tv', FakeFireTV([(STATE_IDLE, None, None)]))
+        token = polls._devices['tv'][1]
+        polls.remove('tv')
+        polls._work.put(('tv', token))
+        polls._work.put(None)
+        polls._work_loop()
+        self.assertNotIn('tv', polls.results)
+
+
+if __name__ == '__main__':
+    unittest.main()
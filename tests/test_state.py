@@ -0,0 +1,53 @@
+import json
+import pickle
+import unittest
+
+from firetv.state import DeviceState
+
+
+class TestDeviceState(unittest.TestCase):
+
+    def test_equal_states_are_interned(self):
+        first = DeviceState('playing', 'com.netflix.ninja', ['com.netflix.ninja', 'com.amazon.tv.launcher'])
+        second = DeviceState.from_tuple(('playing', 'com.netflix.ninja', ('com.netflix.ninja', 'com.amazon.tv.launcher')))
+        self.assertIs(first, second)
+        self.assertEqual(first, second)
+        self.assertEqual(hash(first), hash(second))
+
+    def test_different_states_are_distinct(self):
+        self.assertNotEqual(DeviceState('playing', 'a'), DeviceState('paused', 'a'))
+        self.assertNotEqual(DeviceState('playing', 'a', None), DeviceState('playing', 'a', []))
+
+    def test_strings_are_interned(self):
+        app = ''.join(['com.netflix', '.ninja'])
+        state = DeviceState('playing', app, [app])
+        self.assertIs(state.current_app, state.running_apps[0])
+
+    def test_immutable(self):
+        state = DeviceState('idle')
+        with self.assertRaises(AttributeError):
+            state.state = 'off'
+        with self.assertRaises(AttributeError):
+            del state.current_app
+
+    def test_as_tuple_and_json(self):
+        state = DeviceState('playing', 'a', ['a', 'b'])
+        self.assertEqual(state.as_tuple(), ('playing', 'a', ['a', 'b']))
+        self.assertEqual(state.as_dict(), {'state': 'playing', 'current_app': 'a', 'running_apps': ['a', 'b']})
+        self.assertEqual(json.loads(state.to_json()), state.as_dict())
+
+    def test_diff(self):
+        idle = DeviceState('idle', 'launcher', ['launcher'])
+        playing = DeviceState('playing', 'netflix', ['launcher'])
+        self.assertEqual(playing.diff(playing), {})
+        self.assertEqual(playing.diff(None), {'state': 'playing', 'current_app': 'netflix', 'running_apps': ['launcher']})
+        self.assertEqual(playing.diff(idle), {'state': 'playing', 'current_app': 'netflix'})
+
+    def test_pickle_preserves_interning(self):
+        state = DeviceState('paused', 'netflix', ['netflix'])
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertIs(pickle.loads(pickle.dumps(state, protocol)), state)
+
+
+if __name__ == '__main__':
+    unittest.main()
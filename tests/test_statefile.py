@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from firetv.statefile import StateFileReader, StateFileWriter
+
+
+class TestStateFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'states')
+        self.writer = StateFileWriter(self.path, slots=2)
+        self.reader = StateFileReader(self.path)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+        shutil.rmtree(self.directory)
+
+    def test_publish_and_read(self):
+        self.assertTrue(self.writer.publish('living-room', 'playing', 'com.netflix.ninja', ['com.netflix.ninja'], 100.))
+        self.assertTrue(self.writer.publish('bedroom', 'off', None, None, 200.))
+
+        updated, state = self.reader.get('living-room')
+        self.assertEqual(updated, 100.)
+        self.assertEqual((state.state, state.current_app, list(state.running_apps)),
+                         ('playing', 'com.netflix.ninja', ['com.netflix.ninja']))
+
+        updated, state = self.reader.get('bedroom')
+        self.assertEqual((updated, state.state, state.current_app, state.running_apps), (200., 'off', None, None))
+        self.assertEqual(sorted(self.reader.snapshot()), ['bedroom', 'living-room'])
+
+    def test_full_and_remove(self):
+        self.writer.publish('a', 'idle', None, [])
+        self.writer.publish('b', 'idle', None, [])
+        self.assertFalse(self.writer.publish('c', 'idle', None, []))
+
+        self.writer.remove('a')
+        self.assertIsNone(self.reader.get('a'))
+        self.assertTrue(self.writer.publish('c', 'idle', None, []))
+        self.assertEqual(sorted(self.reader.snapshot()), ['b', 'c'])
+
+    def test_reader_follows_resized_file(self):
+        self.writer.publish('a', 'idle', None, [])
+        self.writer.close()
+        self.writer = StateFileWriter(self.path, slots=4)
+        self.writer.publish('d', 'standby', None, [])
+        self.assertIsNone(self.reader.get('a'))
+        self.assertEqual(self.reader.get('d')[1].state, 'standby')
+        self.assertEqual(self.reader.slots, 4)
+
+    def test_bad_file(self):
+        with open(self.path, 'wb') as bad_file:
+            bad_file.write(b'\x00' * 64)
+        self.assertRaises(ValueError, StateFileReader, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from firetv.uitree import parse_ui_tree
+
+
+DUMP = (b'<?xml version=\'1.0\' encoding=\'UTF-8\' standalone=\'yes\' ?>'
+        b'<hierarchy rotation="0">'
+        b'<node index="0" text="" resource-id="" class="android.widget.FrameLayout" package="com.amazon.tv.launcher" '
+        b'content-desc="" focusable="false" focused="false" bounds="[0,0][1920,1080]">'
+        b'<node index="0" text="Home" resource-id="com.amazon.tv.launcher:id/home" class="android.widget.TextView" '
+        b'package="com.amazon.tv.launcher" content-desc="" focusable="true" focused="false" bounds="[10,20][110,60]" />'
+        b'<node index="1" text="" resource-id="com.amazon.tv.launcher:id/row" class="android.widget.LinearLayout" '
+        b'package="com.amazon.tv.launcher" content-desc="Netflix" focusable="true" focused="true" bounds="[0,100][400,300]">'
+        b'<node index="0" text="Netflix" resource-id="" class="android.widget.TextView" package="com.amazon.tv.launcher" '
+        b'content-desc="" focusable="false" focused="true" bounds="[0,100][400,150]" />'
+        b'</node>'
+        b'</node>'
+        b'</hierarchy>')
+
+
+def _chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestParseUiTree(unittest.TestCase):
+
+    def test_parse_in_chunks(self):
+        for size in (1, 7, 64, len(DUMP)):
+            tree = parse_ui_tree([b'noise before the dump\n'] + _chunks(DUMP, size) + [b'UI hierchary dumped to: /dev/tty\n'])
+            self.assertEqual(len(tree), 4)
+
+    def test_structure(self):
+        tree = parse_ui_tree([DUMP])
+        root, home, row, netflix = tree.nodes
+        self.assertIsNone(root.parent)
+        self.assertEqual((home.parent, row.parent, netflix.parent), (0, 0, 2))
+        self.assertEqual(netflix.depth, 2)
+        self.assertEqual(home.bounds, (10, 20, 110, 60))
+        self.assertEqual(tree.children(row), [netflix])
+
+    def test_find(self):
+        tree = parse_ui_tree([DUMP])
+        self.assertEqual([node.index for node in tree.find(text='Netflix')], [2, 3])
+        self.assertEqual([node.index for node in tree.find(text='Netflix', resource_id='com.amazon.tv.launcher:id/row')], [2])
+        self.assertEqual([node.index for node in tree.find(focused=True)], [2, 3])
+        self.assertEqual(tree.find(text='Settings'), [])
+
+    def test_focused_is_deepest(self):
+        self.assertEqual(parse_ui_tree([DUMP]).focused.text, 'Netflix')
+
+    def test_incomplete_dump(self):
+        self.assertIsNone(parse_ui_tree([DUMP[:len(DUMP) // 2]]))
+        self.assertIsNone(parse_ui_tree([b'ERROR: could not get idle state.\n']))
+
+
+if __name__ == '__main__':
+    unittest.main()